@@ -0,0 +1,145 @@
+"""
+Headless frame benchmark.
+
+Runs the Stardust and Renderer/UnitCube pipelines under SDL's dummy video
+driver, uncapped, for a fixed number of frames with a fixed seed, sweeping the
+number of dusts and cubes. Per-frame timings are reported as JSON:
+
+    $ python benchmark.py --frames 300 --dusts 15,1000,50000 --cubes 110,1000
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+from scenes import StardustScene, CubeScene
+from raster import DUST_RASTERS
+import matrix
+
+WIDTH =800
+HEIGHT=600
+
+def run_scene(scene, frames, warmup):
+    """Returns the wall time in seconds of each of the frames after the warmup"""
+    for i in range(warmup):
+        scene.update()
+        scene.draw()
+        pygame.display.flip()
+
+    times = np.empty(frames)
+    clock = time.perf_counter
+    for i in range(frames):
+        t0 = clock()
+        scene.update()
+        scene.draw()
+        pygame.display.flip()
+        times[i] = clock() - t0
+    return times
+
+def summarize(name, count, times):
+    ms = times * 1000
+    total = times.sum()
+    return {
+        'scene'       : name,
+        'count'       : count,
+        'frames'      : len(times),
+        'mean_ms'     : round(float(ms.mean()), 3),
+        'p50_ms'      : round(float(np.percentile(ms, 50)), 3),
+        'p95_ms'      : round(float(np.percentile(ms, 95)), 3),
+        'p99_ms'      : round(float(np.percentile(ms, 99)), 3),
+        'max_ms'      : round(float(ms.max()), 3),
+        'fps'         : round(len(times) / total, 2),
+        'items_per_s' : round(count * len(times) / total, 1),
+    }
+
+def matrix_calls(repeat=5000):
+    """Microseconds per call of the single 4x4 matrix functions, on each backend"""
+    m = matrix.rot_matrix(r=10, p=20, y=30, xo=1, yo=2, zo=3)
+    calls = {
+        'rot_matrix'    : lambda: matrix.rot_matrix(r=10, p=20, y=30, xo=1, yo=2, zo=3),
+        'rigid_matrix'  : lambda: matrix.rigid_matrix(m[:3,:3], m[:3,3]),
+        'rigid_inverse' : lambda: matrix.rigid_inverse(m[:3,:3], m[:3,3]),
+    }
+    backend = matrix.BACKEND
+    timings = {}
+    try:
+        for name in matrix.BACKENDS:
+            matrix.set_backend(name)
+            timings[name] = { call: round(timeit.timeit(f, number=repeat) / repeat * 1e6, 3) for call, f in calls.items() }
+    finally:
+        matrix.set_backend(backend)
+    return timings
+
+def benchmark(dust_counts, cube_counts, frames=300, warmup=30, seed=0, raster='pixels', lines='draw'):
+    pygame.display.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+
+    results = []
+    for n in dust_counts:
+        np.random.seed(seed)
+        times = run_scene(StardustScene(screen, num_dusts=n, raster=raster), frames, warmup)
+        results.append(summarize('stardust', n, times))
+
+    for n in cube_counts:
+        np.random.seed(seed)
+        times = run_scene(CubeScene(screen, num_cubes=n, lines=lines), frames, warmup)
+        results.append(summarize('cubes', n, times))
+
+    pygame.display.quit()
+
+    return {
+        'config' : {
+            'frames' : frames,
+            'warmup' : warmup,
+            'seed'   : seed,
+            'raster' : raster,
+            'lines'  : lines,
+            'matrix' : matrix.BACKEND,
+            'width'  : WIDTH,
+            'height' : HEIGHT,
+            'driver' : os.environ['SDL_VIDEODRIVER'],
+            'numpy'  : np.__version__,
+            'pygame' : pygame.version.ver,
+            'python' : sys.version.split()[0],
+        },
+        'results' : results,
+        'matrix_us' : matrix_calls(),
+    }
+
+def counts(arg):
+    return [ int(n) for n in arg.split(',') if n ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=300, help='Timed frames per run')
+    parser.add_argument('--warmup', type=int, default=30,  help='Untimed frames before each run')
+    parser.add_argument('--seed',   type=int, default=0)
+    parser.add_argument('--dusts',  type=counts, default=[15, 1000, 10000], help='Comma separated dust counts')
+    parser.add_argument('--cubes',  type=counts, default=[110, 1000],       help='Comma separated cube counts')
+    parser.add_argument('--raster', choices=sorted(DUST_RASTERS), default='pixels', help='Dust rasterizer')
+    parser.add_argument('--lines',  choices=['draw', 'pixels'], default='draw', help='Cube edge rasterizer')
+    parser.add_argument('--matrix', choices=matrix.BACKENDS, default=matrix.BACKEND, help='Backend of the single 4x4 matrix functions')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    matrix.set_backend(args.matrix)
+    report = benchmark(args.dusts, args.cubes, args.frames, args.warmup, args.seed, args.raster, args.lines)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
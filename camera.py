@@ -1,10 +1,11 @@
 import math
-from numpy.linalg import inv
 
 from matrix import *
 
 class Camera():
 
+    orthonormalize_every = 32 # Camera updates between re-orthonormalizations of the rotation
+
     def __init__(self):
 
         self.camera = c = {
@@ -16,22 +17,41 @@ class Camera():
             'z_offset' : -1.3, # 13.5
         }
         self.camera_matrix = None
+        self.rotation      = None # 3x3 rotation part of the camera matrix
+        self.translation   = None # Translation part of the camera matrix
+        self.updates       = 0
+        self.previous      = None # (rotation, translation) at the start of the simulation step
         
         self.cal_camera_matrix(
            rot_matrix(r=c['roll'], p=c['pitch'], y=c['yaw'],
                       xo=c['x_offset'], yo=c['y_offset'], zo=c['z_offset'])
         )
+        self.begin_step()
 
 
     def cal_camera_matrix(self, delta_matrix):
         """
         Camera/View Space := v_camera = V⋅M⋅v_model
+
+        The camera matrix is always a rotation plus a translation, C = [R t], so
+        C⋅Cdelta = [R⋅Rdelta  R⋅tdelta + t]
         """
-        # V = = C−1 - inverse
-        self.camera_matrix = delta_matrix if self.camera_matrix is None else matmul(self.camera_matrix, delta_matrix)
-        # Inverse
-        # linalg inv is very CPU intensive unless setting this in the environment: $ export OPENBLAS_NUM_THREADS=1        
-        self.view_matrix   = inv(self.camera_matrix) # inv(self.camera_matrix) 
+        r_delta = delta_matrix[:3,:3]
+        t_delta = delta_matrix[:3, 3]
+        if self.rotation is None:
+            self.rotation    = r_delta.copy()
+            self.translation = t_delta.copy()
+        else:
+            self.translation = matmul(self.rotation, t_delta) + self.translation
+            self.rotation    = matmul(self.rotation, r_delta)
+
+        self.updates += 1
+        if self.updates % self.orthonormalize_every == 0:
+            self.rotation = orthonormalize(self.rotation)
+
+        self.camera_matrix = rigid_matrix(self.rotation, self.translation)
+        # V = C−1 = [Rᵀ  -Rᵀ⋅t], no general inverse needed
+        self.view_matrix   = rigid_inverse(self.rotation, self.translation)
         self.camera_changed = True       
 
 
@@ -62,12 +82,32 @@ class Camera():
 
             self.cal_camera_matrix(delta)
         
-    def get_view_matrix(self):
-        self.camera_changed = False
-        return self.view_matrix
+    def begin_step(self):
+        """Remember the pose at the start of a fixed simulation step, to interpolate from"""
+        self.previous = (self.rotation, self.translation)
+
+    def is_moving(self):
+        """The camera moved during the last simulation step"""
+        return self.previous[0] is not self.rotation or self.previous[1] is not self.translation
+
+    def get_view_matrix(self, alpha=None):
+        """
+        alpha interpolates the view between the pose at the start of the last
+        simulation step and the current one. An in-between view leaves the camera
+        changed, so that the exact view is still loaded once the camera stops.
+        """
+        if alpha is None or not self.is_moving():
+            self.camera_changed = False
+            return self.view_matrix
+
+        self.camera_changed = True
+        r0, t0 = self.previous
+        rotation    = orthonormalize(r0 + (self.rotation - r0) * alpha)
+        translation = t0 + (self.translation - t0) * alpha
+        return rigid_inverse(rotation, translation)
 
     def view_has_changed(self):
-        """Since last get_view_matrix()"""
+        """The exact view has not been returned by get_view_matrix() since it changed"""
         return self.camera_changed
     
 
@@ -4,15 +4,17 @@ class FlightControls():
     full_pitch_s = 12
     full_roll_s  = 6
     
-    def __init__(self, fps):
+    def __init__(self, hz):
         """
+        hz   := simulation steps per second, see SimClock
+
         pitch:= 12 seconds per full rotation 360
               = 30 deg per second
-              = 1 deg / frame at 30 fps
+              = 1 deg / step at 30 hz
 
         roll := 6 seconds per full rotation 360
               = 60 per second
-              = 2 deg / frame at 30 fps
+              = 2 deg / step at 30 hz
         """
         
         self.speed = 10.0
@@ -20,8 +22,8 @@ class FlightControls():
         self.beta  = 0.0 
 
         self.s_max = 28.0
-        self.a_max = 360.0 / self.full_roll_s  / fps * self.degree
-        self.b_max = 360.0 / self.full_pitch_s / fps * self.degree
+        self.a_max = 360.0 / self.full_roll_s  / hz * self.degree
+        self.b_max = 360.0 / self.full_pitch_s / hz * self.degree
 
         self.s_step = 2.0
         self.a_step = self.a_max / 16
@@ -0,0 +1,59 @@
+import numpy as np
+
+def frustum_planes(m):
+    """
+    The 6 frustum planes (left, right, bottom, top, near, far) of a P⋅V matrix as
+    a (6,4) array of normalized [a, b, c, d]. A point p is inside all of them when
+    a⋅x + b⋅y + c⋅z + d >= 0 (Gribb & Hartmann).
+    """
+    planes = np.array([
+        m[3] + m[0],
+        m[3] - m[0],
+        m[3] + m[1],
+        m[3] - m[1],
+        m[3] + m[2],
+        m[3] - m[2],
+    ], dtype=np.float64)
+    planes /= np.sqrt(np.sum(planes[:,:3]**2, axis=1, keepdims=True))
+    return planes
+
+def spheres_visible(planes, centers, radii):
+    """Boolean mask of the bounding spheres (centers (N,3), radii) touching the frustum"""
+    distances = centers @ planes[:,:3].T + planes[:,3]   # (N,6)
+    return np.all(distances >= -np.reshape(radii, (-1, 1)), axis=1)
+
+
+class UniformGrid():
+
+    def __init__(self, centers, radii, cell_size=8.0):
+        """
+        A uniform grid over static bounding spheres. Each occupied cell gets a bounding
+        sphere of its own, so that a whole cell of objects is rejected by one test.
+        """
+        self.centers   = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.radii     = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(self.centers),))
+        self.cell_size = cell_size
+
+        cells = np.floor(self.centers / cell_size).astype(np.int64)
+        keys, cell_of = np.unique(cells, axis=0, return_inverse=True)
+        cell_of = cell_of.ravel()
+
+        # Objects ordered by cell
+        self.order   = np.argsort(cell_of, kind='stable')
+        self.cell_of = cell_of[self.order]
+
+        # Cell spheres: around the cell box, grown by the largest radius inside it
+        self.cell_centers = (keys + 0.5) * cell_size
+        max_radii = np.zeros(len(keys))
+        np.maximum.at(max_radii, cell_of, self.radii)
+        self.cell_radii = np.sqrt(3) / 2 * cell_size + max_radii
+
+    def __len__(self):
+        return len(self.centers)
+
+    def query(self, planes):
+        """Indices, in ascending order, of the objects whose spheres touch the frustum"""
+        cells_visible = spheres_visible(planes, self.cell_centers, self.cell_radii)
+        candidates = self.order[cells_visible[self.cell_of]]
+        visible = spheres_visible(planes, self.centers[candidates], self.radii[candidates])
+        return np.sort(candidates[visible])
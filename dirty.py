@@ -0,0 +1,67 @@
+import numpy as np
+import pygame
+
+def dust_rects(points, max_size):
+    """(N,4) x, y, w, h bounding rects of the dusts as drawn by raster.DUST_RASTERS"""
+    xs, ys, sizes = points
+    radii = np.clip(sizes, 0, int(max_size)).astype(int)
+    shown = radii > 0
+    r = radii[shown]
+    return np.stack((xs[shown].astype(int) - r, ys[shown].astype(int) - r, 2*r + 1, 2*r + 1), axis=1)
+
+
+class DirtyRects():
+
+    def __init__(self, screen, background=(0, 0, 0), max_coverage=0.25, max_rects=2000):
+        """
+        Dirty-rectangle display updates for sparse scenes.
+
+        Instead of filling and flipping the whole screen every frame, erase() paints the
+        background over only what was drawn in the previous frame, and present() pushes
+        only the old and new rects with pygame.display.update(). When the rects cover
+        more than max_coverage of the screen, or there are more than max_rects of them,
+        a full flip is cheaper and is used instead.
+        """
+        self.screen       = screen
+        self.background   = background
+        self.max_coverage = max_coverage
+        self.max_rects    = max_rects
+        self.area         = screen.get_width() * screen.get_height()
+        self.previous     = np.zeros((0, 4), dtype=int)
+        self.clear_all    = True  # Nothing is known about the screen yet
+        self.fills        = {}    # Background surfaces by (w, h)
+        self.full_frames  = 0     # Frames that fell back to a full flip
+
+    def erase(self):
+        if self.clear_all:
+            self.screen.fill(self.background)
+            return
+
+        # One blits call for all the rects, one background surface per size
+        fills = self.fills
+        blits = []
+        for x, y, w, h in self.previous.tolist():
+            fill = fills.get((w, h))
+            if fill is None:
+                fill = fills[(w, h)] = pygame.Surface((w, h))
+                fill.fill(self.background)
+            blits.append((fill, (x, y)))
+        self.screen.blits(blits, doreturn=False)
+
+    def present(self, rects, full=False):
+        """
+        rects: (N,4) array of everything drawn since erase().
+        full:  something untracked was drawn, flip and clear everything next frame.
+        """
+        rects = np.asarray(rects, dtype=int).reshape(-1, 4)
+        changed = np.concatenate((self.previous, rects))
+        coverage = np.sum(changed[:,2] * changed[:,3]) / self.area
+
+        if full or self.clear_all or coverage > self.max_coverage or len(changed) > self.max_rects:
+            pygame.display.flip()
+            self.full_frames += 1
+        else:
+            pygame.display.update(changed.tolist())
+
+        self.previous  = rects
+        self.clear_all = full
@@ -0,0 +1,101 @@
+"""
+Offscreen render-to-video export.
+
+Renders a scene into a NumPy framebuffer, without a window and ignoring the
+wall clock, and streams the raw rgb24 frames to a memory-mapped file or to
+stdout:
+
+    $ python export.py stardust --frames 300 --output stardust.rgb
+    $ python export.py cubes --frames 300 --output - | ffmpeg -f rawvideo -pix_fmt rgb24 -s 800x600 -r 30 -i - cubes.mov
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+from scenes import SCENES, create_scene
+
+WIDTH =800
+HEIGHT=600
+
+class Framebuffer():
+
+    def __init__(self, width, height):
+        """
+        A preallocated (height, width, 3) rgb24 array with a pygame Surface drawing
+        straight into it, so a finished frame is already laid out as raw video.
+        """
+        self.width, self.height = width, height
+        self.pixels  = np.zeros((height, width, 3), dtype=np.uint8)
+        self.surface = pygame.image.frombuffer(self.pixels, (width, height), 'RGB')
+
+
+class MemmapWriter():
+
+    def __init__(self, path, num_frames, width, height):
+        self.frames = np.memmap(path, dtype=np.uint8, mode='w+', shape=(num_frames, height, width, 3))
+        self.index  = 0
+
+    def write(self, pixels):
+        self.frames[self.index] = pixels
+        self.index += 1
+
+    def close(self):
+        self.frames.flush()
+        del self.frames
+
+
+class PipeWriter():
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, pixels):
+        # The framebuffer is contiguous, no copy needed
+        self.stream.write(memoryview(pixels).cast('B'))
+
+    def close(self):
+        self.stream.flush()
+
+
+def export(scene, framebuffer, writer, num_frames):
+    for i in range(num_frames):
+        scene.update()
+        scene.draw()
+        writer.write(framebuffer.pixels)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scene', choices=sorted(SCENES))
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--count',  type=int, help='Number of dusts or cubes')
+    parser.add_argument('--seed',   type=int, default=0)
+    parser.add_argument('--output', required=True, help="Raw rgb24 file, or - for stdout")
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    framebuffer = Framebuffer(WIDTH, HEIGHT)
+    scene = create_scene(args.scene, framebuffer.surface, args.count)
+
+    if args.output == '-':
+        writer = PipeWriter(sys.stdout.buffer)
+    else:
+        writer = MemmapWriter(args.output, args.frames, WIDTH, HEIGHT)
+
+    t0 = time.perf_counter()
+    export(scene, framebuffer, writer, args.frames)
+    writer.close()
+    seconds = time.perf_counter() - t0
+
+    print(f'{args.frames} frames in {seconds:.2f}s ({args.frames/seconds:.1f} fps), '
+          f'rawvideo rgb24 {WIDTH}x{HEIGHT}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import pygame
+
+# Glyphs pre-rendered into the atlas, any other character is rendered on first use
+ATLAS_CHARS = ''.join(chr(c) for c in range(32, 127))
+
+class GlyphAtlas():
+
+    def __init__(self, font, color, chars=ATLAS_CHARS, antialias=True):
+        """
+        Every glyph of chars rendered once, side by side into one surface, so that
+        a string is drawn by blitting its glyphs out of the atlas in one blits()
+        call instead of a font.render() per frame.
+
+        Each glyph advances by its own width, kerning is ignored, which is exact
+        for the monospaced HUD font.
+        """
+        self.font      = font
+        self.color     = color
+        self.antialias = antialias
+        self.height    = font.get_height()
+        self.glyphs    = {} # char: (surface, area)
+
+        width = sum(font.size(ch)[0] for ch in chars)
+        self.surface = pygame.Surface((max(width, 1), self.height), pygame.SRCALPHA)
+        x = 0
+        for ch in chars:
+            glyph = font.render(ch, antialias, color)
+            self.surface.blit(glyph, (x, 0))
+            self.glyphs[ch] = (self.surface, pygame.Rect(x, 0, glyph.get_width(), self.height))
+            x += glyph.get_width()
+
+    def glyph(self, ch):
+        g = self.glyphs.get(ch)
+        if g is None:
+            surface = self.font.render(ch, self.antialias, self.color)
+            g = self.glyphs[ch] = (surface, surface.get_rect())
+        return g
+
+    def size(self, text):
+        return sum(self.glyph(ch)[1].width for ch in text), self.height
+
+    def compose(self, blits, text, x, y):
+        """Appends the blits of text at x, y to blits, returns the x after it"""
+        glyphs = self.glyphs
+        for ch in text:
+            glyph, area = glyphs.get(ch) or self.glyph(ch)
+            blits.append((glyph, (x, y), area))
+            x += area.width
+        return x
+
+    def draw(self, surface, text, pos):
+        """Blits text at pos, returns the rect drawn over"""
+        blits = []
+        x = self.compose(blits, text, *pos)
+        surface.blits(blits, doreturn=False)
+        return pygame.Rect(pos[0], pos[1], x - pos[0], self.height)
+
+
+class Hud():
+
+    def __init__(self, font, color=(255, 255, 0)):
+        """
+        Text overlays without a font.render() per frame:
+
+            hud.draw(screen, (10, 10), [('fps: ', f'{fps:.1f}'), (', view: ', view.name)])
+
+        Labels, the text of each field that changes now and then, are rendered
+        once and kept as surfaces, so a label is only re-rendered when it changes.
+        Values, the numbers that change every frame, are composed out of the
+        glyph atlas.
+        """
+        self.font   = font
+        self.color  = color
+        self.atlas  = GlyphAtlas(font, color)
+        self.labels = {} # Rendered surfaces by text
+
+    max_labels = 256 # Labels cached before the cache starts over
+
+    def label(self, text):
+        surface = self.labels.get(text)
+        if surface is None:
+            if len(self.labels) >= self.max_labels:
+                self.labels.clear()
+            surface = self.labels[text] = self.font.render(text, True, self.color)
+        return surface
+
+    def draw(self, surface, pos, fields):
+        """fields := (label, value) pairs drawn one after the other, returns the rect drawn over"""
+        x, y  = pos
+        blits = [] # All of it in one blits() call
+        for label, value in fields:
+            if label:
+                text = self.label(label)
+                blits.append((text, (x, y)))
+                x += text.get_width()
+            if value:
+                x = self.atlas.compose(blits, value, x, y)
+        surface.blits(blits, doreturn=False)
+        return pygame.Rect(pos[0], y, x - pos[0], self.atlas.height)
+
+    def draw_label(self, surface, text, **where):
+        """A cached label placed by pygame.Rect keyword arguments, e.g. center=(x, y)"""
+        text = self.label(text)
+        return surface.blit(text, text.get_rect(**where))
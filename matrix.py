@@ -6,8 +6,36 @@ epsilon=1.0e-6
 sin = math.sin
 cos = math.cos
 
+#
+# dtype policy: matrices, vertices and projected points are all DTYPE, and the
+# per-frame transforms write into preallocated arrays through out=, so that no
+# float64 temporaries or upcasts are made along the way.
+#
+DTYPE = np.float32
+
 def np_array(array):
-    return np.array( array, dtype=np.float32 )
+    return np.array( array, dtype=DTYPE )
+
+#
+# Backends of the scalar-sized functions, a single 4x4 at a time: rot_matrix(),
+# rigid_matrix() and rigid_inverse(). For a 4x4, NumPy's per-call overhead is
+# most of the cost, so the 'small' backend computes them in closed form on flat
+# row-major tuples of Python floats, unrolled, and makes one DTYPE array at the
+# end. 'numpy' multiplies out the NumPy matrices. Bulk work, and matmul(), is
+# always NumPy: a single product through tuples is no faster once the arrays
+# are converted in and out. test_matrix.py checks that the two agree.
+#
+BACKENDS = ('small', 'numpy')
+BACKEND  = 'small'
+
+def set_backend(name):
+    global BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"unknown matrix backend {name}, one of {', '.join(BACKENDS)}")
+    BACKEND = name
+
+def _array(t, shape=(4, 4)):
+    return np.array(t, dtype=DTYPE).reshape(shape)
 
 # Small angle approximations
 #
@@ -45,20 +73,203 @@ def yaw_matrix(y):
     ])
 
 def composite_matrix(r, p, y, xo, yo, zo):
+    return _array(composite_tuple(r, p, y, xo, yo, zo))
+
+def composite_tuple(r, p, y, xo, yo, zo):
+    """T⋅Y⋅P⋅R, angles in radians, as a flat row-major tuple"""
     c_r, s_r = cos(r), sin(r)
     c_p, s_p = cos(p), sin(p)
     c_y, s_y = cos(y), sin(y)
 
-    return np_array([
-        [  c_y*c_r+s_y*s_p*s_r,  c_y*-s_r+s_y*s_p*c_r,  s_y*c_p, xo],
-        [              c_p*s_r,               c_p*c_r,     -s_p, yo],
-        [ -s_y*c_r+c_y*s_p*s_r, -s_y*-s_r+c_y*s_p*c_r,  c_y*c_p, zo],
-        [                    0,                     0,        0,  1]
+    return (
+          c_y*c_r+s_y*s_p*s_r,  c_y*-s_r+s_y*s_p*c_r,  s_y*c_p, xo,
+                      c_p*s_r,               c_p*c_r,     -s_p, yo,
+         -s_y*c_r+c_y*s_p*s_r, -s_y*-s_r+c_y*s_p*c_r,  c_y*c_p, zo,
+                            0,                     0,        0,  1,
+    )
+
+#
+# Batched versions. Each argument is a scalar or an array of N values, the
+# result is an (N,4,4) stack of matrices.
+#
+def _batch(*args):
+    args = np.broadcast_arrays(*[ np.atleast_1d(np.asarray(a, dtype=np.float64)) for a in args ])
+    m = np.zeros((args[0].size, 4, 4), dtype=DTYPE)
+    m[:, 3, 3] = 1
+    return m, [ a.ravel() for a in args ]
+
+def roll_matrices(r):
+    # roll - z axis
+    m, (r,) = _batch(r)
+    c, s = np.cos(r), np.sin(r)
+    m[:,0,0], m[:,0,1] = c, -s
+    m[:,1,0], m[:,1,1] = s,  c
+    m[:,2,2] = 1
+    return m
+
+def pitch_matrices(p):
+    # pitch - x axis
+    m, (p,) = _batch(p)
+    c, s = np.cos(p), np.sin(p)
+    m[:,0,0] = 1
+    m[:,1,1], m[:,1,2] = c, -s
+    m[:,2,1], m[:,2,2] = s,  c
+    return m
+
+def yaw_matrices(y):
+    # yaw  - y axis
+    m, (y,) = _batch(y)
+    c, s = np.cos(y), np.sin(y)
+    m[:,0,0], m[:,0,2] =  c, s
+    m[:,1,1] = 1
+    m[:,2,0], m[:,2,2] = -s, c
+    return m
+
+def composite_matrices(r, p, y, xo, yo, zo):
+    m, (r, p, y, xo, yo, zo) = _batch(r, p, y, xo, yo, zo)
+    c_r, s_r = np.cos(r), np.sin(r)
+    c_p, s_p = np.cos(p), np.sin(p)
+    c_y, s_y = np.cos(y), np.sin(y)
+
+    m[:,0,0], m[:,0,1], m[:,0,2], m[:,0,3] =  c_y*c_r+s_y*s_p*s_r,  c_y*-s_r+s_y*s_p*c_r,  s_y*c_p, xo
+    m[:,1,0], m[:,1,1], m[:,1,2], m[:,1,3] =              c_p*s_r,               c_p*c_r,     -s_p, yo
+    m[:,2,0], m[:,2,1], m[:,2,2], m[:,2,3] = -s_y*c_r+c_y*s_p*s_r, -s_y*-s_r+c_y*s_p*c_r,  c_y*c_p, zo
+    return m
+
+def rot_matrices(r=0, p=0, y=0, xo=0, yo=0, zo=0):
+    """
+    Batched rot_matrix(), angles in degrees. T⋅Y⋅P⋅R is multiplied out in
+    closed form (composite_matrices) rather than by three matmuls.
+    """
+    return composite_matrices(np.multiply(r, DEGREES), np.multiply(p, DEGREES), np.multiply(y, DEGREES), xo, yo, zo)
+
+def rigid_matrix(rotation, translation):
+    """4x4 from a 3x3 rotation and a translation"""
+    if BACKEND == 'small':
+        (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = rotation.tolist()
+        t0, t1, t2 = translation.tolist()
+        return _array((
+            r00, r01, r02, t0,
+            r10, r11, r12, t1,
+            r20, r21, r22, t2,
+              0,   0,   0,  1,
+        ))
+    m = np.identity(4, dtype=DTYPE)
+    m[:3,:3] = rotation
+    m[:3, 3] = translation
+    return m
+
+def rigid_inverse(rotation, translation):
+    """The inverse of rigid_matrix(rotation, translation), [Rᵀ  -Rᵀ⋅t]"""
+    if BACKEND == 'small':
+        (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = rotation.tolist()
+        t0, t1, t2 = translation.tolist()
+        return _array((
+            r00, r10, r20, -(r00*t0 + r10*t1 + r20*t2),
+            r01, r11, r21, -(r01*t0 + r11*t1 + r21*t2),
+            r02, r12, r22, -(r02*t0 + r12*t1 + r22*t2),
+              0,   0,   0,  1,
+        ))
+    r_inv = rotation.T
+    return rigid_matrix(r_inv, -matmul(r_inv, translation))
+
+def orthonormalize(rotation):
+    """
+    Gram-Schmidt on the columns of a (..., 3, 3) rotation, removing the drift
+    that repeated float32 products build up.
+    """
+    x, y = rotation[...,:,0], rotation[...,:,1]
+    x = x / np.sqrt(np.sum(x*x, axis=-1, keepdims=True))
+    y = y - np.sum(x*y, axis=-1, keepdims=True) * x
+    y = y / np.sqrt(np.sum(y*y, axis=-1, keepdims=True))
+    z = np.cross(x, y)
+    return np.stack((x, y, z), axis=-1).astype(DTYPE)
+
+#
+# Quaternions, (..., 4) arrays of w, x, y, z. The rotations are those of
+# roll_matrix (z axis), pitch_matrix (x axis) and yaw_matrix (y axis).
+#
+def axis_quaternions(axis, angles):
+    """Rotations by angles (radians) about axis 0: x, 1: y, 2: z"""
+    angles = np.atleast_1d(np.asarray(angles, dtype=np.float64))
+    q = np.zeros(angles.shape + (4,))
+    q[...,0] = np.cos(angles / 2)
+    q[...,1 + axis] = np.sin(angles / 2)
+    return q
+
+def product_matrices(d):
+    """
+    (..., 4, 4) matrices R(d) such that q ⊗ d = R(d)⋅q, with q as a column.
+    With R(d) made once, right-multiplying a stack of quaternions by d is a
+    single batched matmul.
+    """
+    w, x, y, z = np.moveaxis(np.asarray(d), -1, 0)
+    return np.stack([
+        np.stack([ w, -x, -y, -z ], axis=-1),
+        np.stack([ x,  w,  z, -y ], axis=-1),
+        np.stack([ y, -z,  w,  x ], axis=-1),
+        np.stack([ z,  y, -x,  w ], axis=-1),
+    ], axis=-2)
+
+def euler_quaternions(r=0, p=0, y=0):
+    """Batched Y⋅P⋅R as quaternions, the rotation of rot_matrix(), angles in radians"""
+    r, p, y = np.broadcast_arrays(*[ np.atleast_1d(np.asarray(a, dtype=np.float64)) for a in (r, p, y) ])
+    q = axis_quaternions(1, y)
+    q = np.matmul(product_matrices(axis_quaternions(0, p)), q[...,None])[...,0]
+    return np.matmul(product_matrices(axis_quaternions(2, r)), q[...,None])[...,0]
+
+def normalize_quaternions(q):
+    """In place, removing the drift repeated products build up"""
+    q /= np.sqrt(np.sum(q*q, axis=-1, keepdims=True))
+    return q
+
+def quaternions_from_rotations(rotations):
+    """(N,4) unit quaternions of (N,3,3) rotations"""
+    m = np.asarray(rotations, dtype=np.float64).reshape(-1, 3, 3)
+    t = m[:,0,0] + m[:,1,1] + m[:,2,2]
+    # Divide by the largest of 4w², 4x², 4y², 4z², for precision
+    sq = np.stack((1 + t, 1 + 2*m[:,0,0] - t, 1 + 2*m[:,1,1] - t, 1 + 2*m[:,2,2] - t), axis=1)
+    k  = np.argmax(sq, axis=1)
+    s  = 2 * np.sqrt(np.take_along_axis(sq, k[:,None], axis=1)[:,0])
+    a, b, c = m[:,2,1] - m[:,1,2], m[:,0,2] - m[:,2,0], m[:,1,0] - m[:,0,1]
+    e, f, g = m[:,0,1] + m[:,1,0], m[:,0,2] + m[:,2,0], m[:,1,2] + m[:,2,1]
+    q = np.choose(k[:,None], [
+        np.stack((s*s/4, a, b, c), axis=1),
+        np.stack((a, s*s/4, e, f), axis=1),
+        np.stack((b, e, s*s/4, g), axis=1),
+        np.stack((c, f, g, s*s/4), axis=1),
     ])
+    return q / s[:,None]
 
-def matmul(m1, m2):
+# Rotation matrix entries as sums of the products of quaternion components:
+# flattened (N,3,3) = flattened q⊗qᵀ (N,16) ⋅ _QUATERNION_ROTATION. Written
+# homogeneously, so that it holds for quaternions not quite unit too.
+_QUATERNION_ROTATION = np.zeros((16, 9), dtype=DTYPE)
+for _entry, _terms in enumerate([
+        ((1,'ww'), (1,'xx'), (-1,'yy'), (-1,'zz')), ((2,'xy'), (-2,'wz')), ((2,'xz'), (2,'wy')),
+        ((2,'xy'), (2,'wz')), ((1,'ww'), (-1,'xx'), (1,'yy'), (-1,'zz')), ((2,'yz'), (-2,'wx')),
+        ((2,'xz'), (-2,'wy')), ((2,'yz'), (2,'wx')), ((1,'ww'), (-1,'xx'), (-1,'yy'), (1,'zz')) ]):
+    for _c, (_i, _j) in _terms:
+        _QUATERNION_ROTATION[4*'wxyz'.index(_i) + 'wxyz'.index(_j), _entry] += _c
+del _entry, _terms, _c, _i, _j
+
+def rotations_from_quaternions(q, out=None, scratch=None):
+    """
+    (N,3,3) rotations of (N,4) quaternions, into out (e.g. the [:, :3, :3] of a stack
+    of model matrices) if given. scratch, if given, is an (N,4,4) DTYPE array.
+    """
+    q = np.asarray(q)
+    products = np.multiply(q[:,:,None], q[:,None,:], out=scratch)
+    m = np.matmul(products.reshape(len(q), 16), _QUATERNION_ROTATION).reshape(len(q), 3, 3)
+    if out is None:
+        return m
+    out[...] = m
+    return out
+
+def matmul(m1, m2, out=None):
     # return _matmul_long(m1, m2) # This is definiely slower, dropping framerate from 30 to 13
-    return np.matmul(m1, m2)
+    # out, if given, is a preallocated DTYPE array of the result's shape
+    return np.matmul(m1, m2, out=out)
   
 def rot_matrix_short(r=0, p=0, y=0, xo=0, yo=0, zo=0):
     r *= DEGREES
@@ -90,6 +301,9 @@ def rot_matrix(r=0, p=0, y=0, xo=0, yo=0, zo=0):
     p *= DEGREES
     y *= DEGREES
 
+    if BACKEND == 'small':
+        return composite_matrix(r, p, y, xo, yo, zo)
+
     roll = roll_matrix(r)
     pitch= pitch_matrix(p)
     yaw  = yaw_matrix(y)
@@ -106,4 +320,3 @@ def rot_matrix(r=0, p=0, y=0, xo=0, yo=0, zo=0):
     result = matmul( matmul ( matmul( translation, yaw), pitch), roll)
 
     return result
-
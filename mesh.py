@@ -0,0 +1,115 @@
+import os
+import numpy as np
+from matrix import DTYPE
+
+#
+# Wireframe model text format, after the Elite ship blueprints
+# (https://elite.bbcelite.com/), so that their VERTEX and EDGE lines can be
+# pasted in as they are:
+#
+#   NAME   Sidewinder
+#   SCALE  0.015625               \ multiplies every vertex
+#   VERTEX -32,  0,  36           \ x, y, z, any further fields (faces, visibility) are ignored
+#   COLOR  255, 255, 0            \ r, g, b of the edges that follow, white until set
+#   EDGE   0, 1                   \ vertex indices, any further fields are ignored
+#   FACE   ...                    \ ignored
+#
+# Everything after a \ or # is a comment.
+#
+
+CACHE_VERSION = 1
+
+class Mesh():
+
+    def __init__(self, vertices, edges, edge_colors, name=''):
+        """
+        vertices    := (V, 3) or (V, 4) model coordinates, stored as (V, 4) DTYPE with w = 1
+        edges       := (E, 2) vertex indices, stored as int32
+        edge_colors := (E, 3) or a single color, stored as (E, 3) uint8
+
+        verticesT is the contiguous column format (4, V) that Renderer.project() takes.
+        """
+        vertices = np.asarray(vertices, dtype=DTYPE).reshape(len(vertices), -1)
+        self.vertices  = np.ones((len(vertices), 4), dtype=DTYPE)
+        self.vertices[:, :3] = vertices[:, :3]
+        self.verticesT = np.ascontiguousarray(self.vertices.T)
+        self.edges     = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+        self.edge_colors = np.ascontiguousarray(np.broadcast_to(np.asarray(edge_colors, dtype=np.uint8), (len(self.edges), 3)))
+        self.name      = name
+
+        # Bounding sphere about the model origin
+        self.radius = float(np.sqrt(np.sum(self.vertices[:,:3]**2, axis=1)).max()) if len(vertices) else 0.0
+
+        if len(self.edges) and (self.edges.min() < 0 or self.edges.max() >= len(self.vertices)):
+            raise ValueError(f"{name}: edge to a vertex out of range")
+
+    def __len__(self):
+        return len(self.edges)
+
+    def draw(self, painter):
+        """All the edges in one batch, under the model matrix on top of the painter's stack"""
+        pv = painter.project(self.verticesT, divide=False)
+        painter.draw_clipped_lines(pv[self.edges[:,0]], pv[self.edges[:,1]], self.edge_colors)
+
+    def save(self, path):
+        np.savez(path, version=CACHE_VERSION, name=self.name,
+                 vertices=self.vertices, edges=self.edges, edge_colors=self.edge_colors)
+
+
+def parse_mesh(text, path='<mesh>'):
+    """A Mesh from the text format above"""
+    name, scale, color = os.path.splitext(os.path.basename(path))[0], 1.0, (255, 255, 255)
+    vertices, edges, colors = [], [], []
+
+    for n, line in enumerate(text.splitlines(), 1):
+        line = line.split('\\')[0].split('#')[0].strip()
+        if not line:
+            continue
+        keyword, _, rest = line.partition(' ')
+        keyword = keyword.upper()
+        fields = [ f.strip() for f in rest.split(',') ]
+        needed = { 'VERTEX': 3, 'COLOR': 3, 'EDGE': 2 }.get(keyword, 0)
+        try:
+            if len(fields) < needed:
+                raise ValueError(f"{keyword} needs {needed} fields")
+            if keyword == 'NAME':
+                name = rest.strip()
+            elif keyword == 'SCALE':
+                scale = float(rest)
+            elif keyword == 'VERTEX':
+                vertices.append([ float(f) for f in fields[:3] ])
+            elif keyword == 'COLOR':
+                color = tuple(int(f) for f in fields[:3])
+            elif keyword == 'EDGE':
+                edges.append([ int(f) for f in fields[:2] ])
+                colors.append(color)
+            elif keyword == 'FACE':
+                pass
+            else:
+                raise ValueError(f"unknown keyword {keyword}")
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"{path}:{n}: {e}") from None
+
+    vertices = np.array(vertices, dtype=np.float64).reshape(-1, 3) * scale
+    return Mesh(vertices, np.array(edges).reshape(-1, 2), np.array(colors).reshape(-1, 3), name)
+
+
+def load_mesh(path, cache=True):
+    """
+    A Mesh from a model file. The parsed arrays are cached next to it as an .npz,
+    which is used for as long as it is newer than the model file.
+    """
+    cache_path = os.path.splitext(path)[0] + '.npz'
+    if cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        with np.load(cache_path) as data:
+            if data['version'] == CACHE_VERSION:
+                return Mesh(data['vertices'], data['edges'], data['edge_colors'], str(data['name']))
+
+    with open(path) as f:
+        mesh = parse_mesh(f.read(), path)
+    if cache:
+        try:
+            mesh.save(cache_path)
+        except OSError:
+            pass # A read-only model directory only costs the parse
+    return mesh
@@ -0,0 +1,225 @@
+"""
+Parallel offline rendering of a deterministic flight.
+
+The flight, a replay.py log or a generated one, is split into chunks of
+frames. The main process runs the (cheap) simulation ahead and snapshots the
+state at the start of every chunk; a pool of worker processes restores the
+snapshots and renders the chunks straight into a ring of frames in shared
+memory, so no pixel data is pickled. Frames are written out in order as raw
+rgb24, like export.py:
+
+    $ python offline.py --log flight.log --workers 8 --output flight.rgb
+    $ python offline.py --scene stardust --frames 900 --output - | ffmpeg -f rawvideo -pix_fmt rgb24 -s 800x600 -r 30 -i - flight.mov
+"""
+import os
+import sys
+import math
+import time
+import pickle
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+import replay
+from export import MemmapWriter, PipeWriter
+
+WIDTH =800
+HEIGHT=600
+
+class StardustFlight():
+
+    kind = replay.STARDUST
+
+    def __init__(self, seed, count=None, hz=30):
+        from stardust import Stardust
+        np.random.seed(seed)
+        self.stardust = Stardust(WIDTH, HEIGHT, num_dusts=count or None)
+        self.raster   = None
+
+    def step(self, r):
+        return replay.step_stardust(self.stardust, r)
+
+    def draw(self, surface):
+        from stardust import Stardust, project_dusts
+        from raster import PixelDusts
+        if self.raster is None:
+            self.raster = PixelDusts(Stardust.max_dust_size)
+        surface.fill((0, 0, 0))
+        self.raster.draw(surface, project_dusts(self.stardust))
+
+    def __getstate__(self):
+        # Sprites are Surfaces, rebuild them after unpickling
+        return dict(self.__dict__, raster=None)
+
+
+class CubeFlight():
+
+    kind = replay.CUBES
+
+    def __init__(self, seed, count=None, hz=30):
+        from camera import Camera
+        from projection_test import create_cubes
+        np.random.seed(seed)
+        self.camera = Camera()
+        self.cubes  = create_cubes([], hz=hz)
+        self.paint  = None
+
+    def step(self, r):
+        return replay.step_cubes(self.camera, self.cubes, r)
+
+    def draw(self, surface):
+        from renderer import Renderer
+        if self.paint is None:
+            self.paint = Renderer(surface, WIDTH/2, HEIGHT/2)
+            self.paint.camera = self.camera
+        self.paint.screen = surface
+        surface.fill((0, 0, 0))
+        self.paint.begin_draw()
+        self.cubes.draw(self.paint)
+        self.paint.end_draw()
+
+    def __getstate__(self):
+        # The Renderer holds a Surface, rebuild it after unpickling
+        return dict(self.__dict__, paint=None)
+
+
+FLIGHTS = {
+    replay.STARDUST : StardustFlight,
+    replay.CUBES    : CubeFlight,
+}
+
+def snapshot(flight):
+    """The flight together with the global RNG state it draws from"""
+    return pickle.dumps((flight, np.random.get_state()), protocol=pickle.HIGHEST_PROTOCOL)
+
+def restore(data):
+    flight, rng_state = pickle.loads(data)
+    np.random.set_state(rng_state)
+    return flight
+
+def generated_records(kind, frames):
+    """A deterministic flight: a slow roll and pitch oscillation, or a slow yaw"""
+    from stardust import Stardust
+    records = np.zeros(frames, dtype=replay.RECORDS[kind])
+    t = np.arange(frames) / 30
+    if kind == replay.STARDUST:
+        records['view']  = 1 # FRONT
+        records['move']  = 1
+        records['dusts'] = Stardust.num_dusts
+        records['speed'] = 10.0
+        records['alpha'] = np.round(0.035 * np.sin(t / 4), 5)
+        records['beta']  = np.round(0.0175 * np.sin(t / 7), 5)
+    else:
+        records['y']     = 1
+    return records
+
+#
+# Worker side
+#
+_ring = None
+
+def _attach(name, shape):
+    global _ring, _shm
+    _shm  = shared_memory.SharedMemory(name=name)
+    _ring = np.ndarray(shape, dtype=np.uint8, buffer=_shm.buf)
+
+def render_chunk(data, records, slot):
+    """Render one frame per record into the ring, from slot onwards"""
+    flight = restore(data)
+    for i, r in enumerate(records):
+        flight.step(r)
+        pixels = _ring[slot + i]
+        flight.draw(pygame.image.frombuffer(pixels, (WIDTH, HEIGHT), 'RGB'))
+    return len(records)
+
+#
+# Main side
+#
+def render(flight, records, writer, workers=None, chunk=30, ring_chunks=None, ring_mb=48):
+    """
+    ring_mb bounds the shared memory ring (/dev/shm, 64 MB by default in Docker).
+    Chunks are made shorter to keep two per worker within it, down to a frame.
+    """
+    workers     = workers or os.cpu_count() or 1
+    ring_chunks = ring_chunks or 2 * workers
+    if ring_mb:
+        frames      = max(1, int(ring_mb * 2**20) // (HEIGHT * WIDTH * 3))
+        ring_chunks = min(ring_chunks, frames)
+        chunk       = max(1, min(chunk, frames // ring_chunks))
+    shape = (ring_chunks * chunk, HEIGHT, WIDTH, 3)
+    shm   = shared_memory.SharedMemory(create=True, size=math.prod(shape))
+    ring  = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(shm.name, shape)) as pool:
+            pending = deque()
+            chunks  = range(0, len(records), chunk)
+            for k, start in enumerate(chunks):
+                # Wait for the oldest chunk when the ring is full, freeing its slots
+                if len(pending) == ring_chunks:
+                    _write_chunk(pending.popleft(), ring, writer)
+
+                part = records[start:start + chunk]
+                slot = (k % ring_chunks) * chunk
+                pending.append((pool.submit(render_chunk, snapshot(flight), part, slot), slot))
+                # Run the simulation ahead to the start of the next chunk
+                for r in part:
+                    flight.step(r)
+
+            while pending:
+                _write_chunk(pending.popleft(), ring, writer)
+    finally:
+        del ring
+        shm.close()
+        shm.unlink()
+
+def _write_chunk(job, ring, writer):
+    future, slot = job
+    for i in range(future.result()):
+        writer.write(ring[slot + i])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--log',     help='A replay.py recording of the flight')
+    parser.add_argument('--scene',   choices=['stardust', 'cubes'], default='stardust', help='Generated flight, without --log')
+    parser.add_argument('--frames',  type=int, default=300, help='Generated flight length, without --log')
+    parser.add_argument('--seed',    type=int, default=0,   help='Generated flight seed, without --log')
+    parser.add_argument('--workers', type=int, help='Worker processes, default: one per CPU')
+    parser.add_argument('--chunk',   type=int, default=30,  help='Frames per chunk')
+    parser.add_argument('--ring-mb', type=float, default=48, help='Shared memory for rendered frames, 0 for two chunks per worker')
+    parser.add_argument('--output',  required=True, help="Raw rgb24 file, or - for stdout")
+    args = parser.parse_args()
+
+    if args.log:
+        kind, seed, sim_hz, count, records, digest = replay.read_log(args.log)
+        if kind == replay.STARDUST:
+            # A last record without a step only carries view resets
+            records = records[records['move'] == 1]
+    else:
+        kind, seed, count, sim_hz = (replay.STARDUST if args.scene == 'stardust' else replay.CUBES), args.seed, None, 30
+        records = generated_records(kind, args.frames)
+
+    flight = FLIGHTS[kind](seed, count, sim_hz)
+    if args.output == '-':
+        writer = PipeWriter(sys.stdout.buffer)
+    else:
+        writer = MemmapWriter(args.output, len(records), WIDTH, HEIGHT)
+
+    t0 = time.perf_counter()
+    render(flight, records, writer, args.workers, args.chunk, ring_mb=args.ring_mb)
+    writer.close()
+    seconds = time.perf_counter() - t0
+
+    print(f'{len(records)} frames in {seconds:.2f}s ({len(records)/seconds:.1f} fps), '
+          f'rawvideo rgb24 {WIDTH}x{HEIGHT}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
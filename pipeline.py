@@ -0,0 +1,86 @@
+import queue
+import threading
+import numpy as np
+
+class Pipeline():
+
+    def __init__(self, step, buffers, threaded=True):
+        """
+        Double-buffered hand-over of frames from a worker thread.
+
+        step(request, buffer) simulates and projects a frame into one of the
+        preallocated buffers. The main loop submits the request for frame N+1 and
+        then collects frame N, the one computed while it drew the frame before,
+        so that the worker works on N+1 while the main thread rasterizes and
+        flips N, and a frame costs about max(simulate, draw) rather than the sum:
+
+            pipeline.submit(request)      # Frame 0
+            while running:
+                pipeline.submit(request)  # Frame N+1, on the worker
+                frame = pipeline.collect()
+                draw(frame)               # Frame N, meanwhile
+                pipeline.release(frame)
+            pipeline.close()
+
+        The buffers go round two queues, free and ready, so neither thread ever
+        touches a buffer the other one holds. Large NumPy operations release the
+        GIL, which is what lets the two overlap.
+
+        Unless threaded, step() runs inside submit() on the calling thread, into
+        the first buffer, and collect() returns it right away: one frame less
+        latency, no overlap.
+        """
+        self.step     = step
+        self.threaded = threaded
+        self.buffer   = buffers[0]
+        if not threaded:
+            return
+
+        self.requests = queue.Queue()
+        self.free     = queue.Queue()
+        self.ready    = queue.Queue()
+        for buffer in buffers:
+            self.free.put(buffer)
+        self.errstate = np.geterr() # np.seterr() is per thread
+        self.worker   = threading.Thread(target=self.run, name='pipeline', daemon=True)
+        self.worker.start()
+
+    def run(self):
+        np.seterr(**self.errstate)
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            buffer = self.free.get()
+            try:
+                self.step(request, buffer)
+            except BaseException as e:
+                self.ready.put((buffer, e))
+                return
+            self.ready.put((buffer, None))
+
+    def submit(self, request):
+        if self.threaded:
+            self.requests.put(request)
+        else:
+            self.step(request, self.buffer)
+
+    def collect(self):
+        """The oldest computed frame, waiting for it if need be"""
+        if not self.threaded:
+            return self.buffer
+        buffer, error = self.ready.get()
+        if error is not None:
+            raise error
+        return buffer
+
+    def release(self, buffer):
+        """Hand a collected buffer back, once drawn"""
+        if self.threaded:
+            self.free.put(buffer)
+
+    def close(self):
+        """Finish the submitted frames and stop the worker"""
+        if self.threaded:
+            self.requests.put(None)
+            self.worker.join()
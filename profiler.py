@@ -0,0 +1,82 @@
+import csv
+import time
+import numpy as np
+import pygame
+
+class FrameProfiler():
+
+    budget = 1/30 # seconds per frame at 30 fps
+
+    def __init__(self, stages, size=300):
+        """
+        Times each stage of a main loop into a fixed-size ring buffer of the last size frames.
+
+            profiler.begin_frame()
+            handle_events();  profiler.mark('events')
+            update();         profiler.mark('update')
+            ...
+            profiler.end_frame()
+
+        mark(stage) charges the time since the previous mark (or begin_frame) to stage.
+        """
+        self.stages  = list(stages)
+        self.index   = { stage: i for i, stage in enumerate(self.stages) }
+        self.size    = size
+        self.times   = np.zeros((size, len(self.stages))) # seconds, one row per frame
+        self.frames  = 0     # Number of frames recorded, the ring wraps at size
+        self.current = np.zeros(len(self.stages))
+        self.last    = None
+        self.show    = False # Overlay toggle
+
+    def begin_frame(self):
+        self.current[:] = 0
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.current[self.index[stage]] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        self.times[self.frames % self.size] = self.current
+        self.frames += 1
+
+    def frame_time(self, exclude=('idle',)):
+        """Seconds of the current frame, without the excluded stages"""
+        return self.current.sum() - sum(self.current[self.index[stage]] for stage in exclude if stage in self.index)
+
+    def toggle(self):
+        self.show = not self.show
+
+    def history(self):
+        """The recorded frames, oldest first"""
+        if self.frames <= self.size:
+            return self.times[:self.frames]
+        i = self.frames % self.size
+        return np.concatenate((self.times[i:], self.times[:i]))
+
+    def means(self):
+        h = self.history()
+        return h.mean(axis=0) if len(h) else self.current
+
+    def draw_overlay(self, screen, hud, pos=(10, 40)):
+        """Mean ms per stage, with a bar showing its share of the frame budget, drawn with a hud.Hud"""
+        if not self.show:
+            return
+        x, y = pos
+        width = 200
+        for stage, t in zip(self.stages + ['total'], np.append(self.means(), self.means().sum())):
+            text = hud.draw(screen, (x, y), [(f'{stage:>7}: ', f'{t*1000:6.2f}'), (' ms', '')])
+            bar = min(int(t / self.budget * width), width)
+            pygame.draw.rect(screen, hud.color, (text.right + 10, y + 4, bar, text.height - 8))
+            y += text.height
+
+    def dump_csv(self, path):
+        """One row per recorded frame, times in ms"""
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame'] + self.stages + ['total'])
+            first = max(0, self.frames - self.size)
+            for i, row in enumerate(self.history()):
+                ms = row * 1000
+                writer.writerow([first + i] + [ f'{t:.3f}' for t in ms ] + [ f'{ms.sum():.3f}' ])
@@ -1,63 +1,70 @@
+from startup import StartupTimer, init_pygame, system_font
 import numpy as np
 
-import yaml
 import math
+import argparse
 
 import pygame
 
 from stardust import Stardust, View
 from controls import FlightControls
 from renderer import Renderer
-from unitcube import UnitCube
+from unitcube import UnitCube, UnitCubes
+from mesh import load_mesh
 from camera   import Delta, Camera
 from matrix import *
+from profiler import FrameProfiler
+from simclock import SimClock, REFERENCE_HZ
+from quality import QualityController
+from pipeline import Pipeline
+from hud import Hud
+import replay
 
 WIDTH =800
 HEIGHT=600
 
-def handle_keys(keys, d):
+def handle_keys(keys, d, scale=1.0):
+    """scale := REFERENCE_HZ / hz, the deltas being per step at REFERENCE_HZ"""
     if keys[pygame.K_UP      ]:
-        d.set_delta(yo=+0.1)
+        d.set_delta(yo=+0.1*scale)
     if keys[pygame.K_DOWN    ]:
-        d.set_delta(yo=-0.1)
+        d.set_delta(yo=-0.1*scale)
     if keys[pygame.K_RIGHT   ]:
-        d.set_delta(xo=+0.1)
+        d.set_delta(xo=+0.1*scale)
     if keys[pygame.K_LEFT    ]:
-        d.set_delta(xo=-0.1)
+        d.set_delta(xo=-0.1*scale)
     if keys[pygame.K_SPACE   ]:
-        d.set_delta(zo=+0.1)
+        d.set_delta(zo=+0.1*scale)
     if keys[pygame.K_SLASH   ]:
-        d.set_delta(zo=-0.1)
+        d.set_delta(zo=-0.1*scale)
     if keys[pygame.K_COMMA   ]:
-        d.set_delta(r=+5)
+        d.set_delta(r=+5*scale)
     if keys[pygame.K_PERIOD  ]:
-       d.set_delta(r=-5)
+       d.set_delta(r=-5*scale)
     if keys[pygame.K_s       ]:
-        d.set_delta(p=+5)
+        d.set_delta(p=+5*scale)
     if keys[pygame.K_x       ]:
-        d.set_delta(p=-5)
+        d.set_delta(p=-5*scale)
     if keys[pygame.K_RIGHTBRACKET ]:
-        d.set_delta(y=+5)
+        d.set_delta(y=+5*scale)
     if keys[pygame.K_LEFTBRACKET  ]:
-        d.set_delta(y=-5)
+        d.set_delta(y=-5*scale)
 
-def display_help(screen, font, center):
+def display_help(screen, hud, center):
     usages = [
         "UP, DOWN, LEFT, RIGHT - Move",
         "s / x - Pitch",
         "< / > - Roll",
         "[ / ] - Yaw",
+        "p - Profile toggle",
         "h - Help toggle"
     ]
 
     for i in range(len(usages)):
         msg = usages[i]
-        text = font.render(msg, True, (255, 255, 0))
-        text_rect = text.get_rect(center=center)
-        text_rect = text_rect.move(0, -(len(usages)/2*36)+i*36)
-        screen.blit(text, text_rect)
+        hud.draw_label(screen, msg, center=(center[0], center[1] - (len(usages)/2*36) + i*36))
 
-def create_cubes(cubes):
+def create_cubes(cubes, mesh=None, hz=REFERENCE_HZ):
     # The code quite comfortably maintain 132 cubes which is 1056 points @ 30 FPS
     # 90 cubes which is 720 points 
     left=-9
@@ -68,35 +75,98 @@ def create_cubes(cubes):
         for j in range(11):
             z = j*step+front
             cubes.append( UnitCube(x, 0.5, z) )
-    return cubes
+    return UnitCubes(cubes, mesh, hz)
 
 def main():
 
-    pygame.init()
+    parser = argparse.ArgumentParser(description="Projection test")
+    parser.add_argument('--profile-csv', help='Write per-stage frame timings to this CSV file on exit')
+    parser.add_argument('--sim-hz',  type=int, default=30, help='Simulation steps per second')
+    parser.add_argument('--max-fps', type=int, default=30, help='Render frame rate cap, 0 for uncapped')
+    parser.add_argument('--seed',    type=int, help='Seed for the random cube spins')
+    parser.add_argument('--record',  help='Record the seed and camera deltas to this file for replay.py')
+    parser.add_argument('--lines',   choices=['draw', 'pixels'], default='draw',
+                        help='Rasterize edges with pygame.draw.line or straight into the pixel array')
+    parser.add_argument('--model',   help='Draw this model file (see mesh.py), e.g. models/sidewinder.ship, in place of the cubes')
+    parser.add_argument('--target-fps', type=int, help='Frame rate the adaptive quality holds, default --max-fps, 0 for fixed quality')
+    parser.add_argument('--pipeline', action='store_true', help='Simulate the next frame on a worker thread while this one is drawn')
+    parser.add_argument('--startup-report', action='store_true', help='Print the time from launch to the first frame')
+    args = parser.parse_args()
+    timer = StartupTimer()
+    timer.mark('imports')
+
+    seed = replay.new_seed() if args.seed is None else args.seed
+    np.random.seed(seed)
+
+    init_pygame()
     pygame.display.set_caption("Stardust")
 
     screen   = pygame.display.set_mode((WIDTH, HEIGHT))
-    font     = pygame.font.SysFont('Courier New, courier, monospace', 20, bold=True)
-    fps      = 30
-
-    controls = FlightControls(fps)
+    timer.mark('display')
+    hud      = Hud(system_font('Courier New, courier, monospace', 20, bold=True))
+    timer.mark('font')
+    controls = FlightControls(args.sim_hz)
     paint    = Renderer(screen, WIDTH/2, HEIGHT/2)
+    paint.line_raster = args.lines
+    sim      = SimClock(args.sim_hz)
+    step     = 0
 
-    dt=0
     help_screen = False
     delta = Delta()
 
-    cubes = create_cubes([])
+    cubes = create_cubes([], load_mesh(args.model) if args.model else None, args.sim_hz)
+    profiler = FrameProfiler(['events', 'update', 'project', 'raster', 'text', 'idle', 'flip'])
+    recorder = replay.Recorder(args.record, replay.CUBES, seed, args.sim_hz, len(cubes)) if args.record else None
+    target   = args.max_fps if args.target_fps is None else args.target_fps
+    quality  = QualityController(target) if target else None
+    limit    = None
+
+    def simulate(request, frame):
+        """Steps the camera and cubes and projects them into frame, on the pipeline's worker thread if it has one"""
+        nonlocal step
+        steps, alpha, pressed, limit, mark = request
+        # Update states, in fixed steps independent of the render rate
+        for i in range(steps):
+            paint.camera.begin_step()
+            # Handle keys pressed
+            if step % 2 == 0:
+                handle_keys(pressed, delta, REFERENCE_HZ / args.sim_hz)
+                # delta.set_delta(y=+2)
+            if delta.changed:
+                paint.camera.set_camera_delta( d=delta )
+            if recorder:
+                recorder.record_cubes(delta)
+            delta.reset()
+            cubes.update()
+            step += 1
+        mark('update')
+
+        paint.begin_draw(alpha)
+        cubes.limit = limit
+        pvs = cubes.project(paint)
+        frame['n'] = n = len(pvs)
+        np.copyto(frame['pvs'][:n], pvs)
+        mark('project')
+
+    # The camera and cubes are only touched by simulate(), the keys pressed are handed to it
+    frames   = [ { 'pvs': np.zeros((len(cubes), len(cubes.mesh.vertices), 4), dtype=DTYPE), 'n': 0 } for i in range(2) ]
+    pipeline = Pipeline(simulate, frames, threaded=args.pipeline)
+    no_mark  = lambda stage: None
+    mark     = no_mark if args.pipeline else profiler.mark # The profiler is not thread safe
+    pipeline.submit((sim.advance(), sim.alpha, pygame.key.get_pressed(), limit, no_mark))
 
     key_mappings = {
+        pygame.K_p: [ profiler, lambda p: p.toggle() ],
     }
 
     running = True
     clock = pygame.time.Clock()
     pygame.event.clear()
+    timer.mark('setup')
     
     # main loop
     while running:
+        profiler.begin_frame()
 
         # Handle Events
         for event in pygame.event.get():
@@ -110,43 +180,59 @@ def main():
                     target_obj = key_mappings[event.key][0]
                     func = key_mappings[event.key][1]
                     func(target_obj)
+        profiler.mark('events')
 
         if help_screen:
             screen.fill((0, 0, 0))            
-            display_help(screen, font, (WIDTH/2, HEIGHT/2))
+            display_help(screen, hud, (WIDTH/2, HEIGHT/2))
             clock.tick(5)            
+            sim.reset() # The simulation is paused
         else:
-            # Handle keys pressed
-            if dt == 0:
-                handle_keys(pygame.key.get_pressed(), delta)
-                # delta.set_delta(y=+2)
-                # Update states
-                if delta.changed:
-                    paint.camera.set_camera_delta( d=delta )
-                    delta.reset()
-            
+            # The next frame is simulated while this one is drawn, when pipelined
+            pipeline.submit((sim.advance(), sim.alpha, pygame.key.get_pressed(), limit, mark))
+            frame = pipeline.collect()
+            profiler.mark('update') # Pipelined, the wait for the worker
+
             #
             # Screen update cycle
             #
             screen.fill((0, 0, 0))
-    
-            paint.begin_draw()
-            for cube in cubes:
-                cube.update()
-                cube.draw(paint)
+            cubes.draw(paint, frame['pvs'][:frame['n']])
             paint.end_draw()
+            pipeline.release(frame)
+            profiler.mark('raster')
     
             # it makes sense to throttle the framerate (which is what the 30 in
             # clock.tick(30) achieves) because it is pointless to have a framerate
             # higher than the screen refresh rate (which is usually 60). To run at
-            # full speed, remove the 30
-            clock.tick(30)
-            text = font.render(f'fps: {clock.get_fps():.1f}; h - HELP', True, (255, 255, 0))
-            screen.blit(text, (10, 10))
-            
-            dt = (dt + 1) % 2
+            # full speed, use --max-fps 0
+            clock.tick(args.max_fps)
+            profiler.mark('idle')
+            fields = [('fps: ', f'{clock.get_fps():.1f}'), ('; h - HELP, p - PROFILE', '')]
+            if quality:
+                fields.append((f'; {quality.label()}', ''))
+            hud.draw(screen, (10, 10), fields)
+            profiler.draw_overlay(screen, hud)
+            profiler.mark('text')
 
         pygame.display.flip()        
+        profiler.mark('flip')
+        if timer:
+            timer.mark('first frame')
+            if args.startup_report:
+                print(timer.report())
+            timer = None
+        profiler.end_frame()
+        if quality and not help_screen and quality.update(profiler.frame_time()):
+            # Fewer, thinner cubes are drawn, all of them are still simulated
+            limit            = quality.count_of(len(cubes))
+            paint.line_width = quality.line_width()
+
+    pipeline.close()
+    if args.profile_csv:
+        profiler.dump_csv(args.profile_csv)
+    if recorder:
+        recorder.close(replay.cubes_digest(paint.camera, cubes))
         
 if __name__ == '__main__':
     main()
@@ -0,0 +1,68 @@
+import numpy as np
+
+class QualityController():
+
+    # Share of full detail at each quality level, level 0 being full detail
+    levels = (1.0, 0.8, 0.6, 0.45, 0.3, 0.2, 0.12, 0.07)
+
+    def __init__(self, target_fps=30, window=30, headroom=0.85):
+        """
+        Holds a target frame time by stepping a quality level up and down.
+
+        update() is fed the time each frame spent working, without the time idled
+        away in clock.tick(), which would otherwise always fill the budget. Once
+        window frames are in, their median is compared with the budget of
+        1/target_fps seconds:
+
+            median > budget                        one level down
+            median * next / current < headroom     one level up, if the better level
+                 * budget                          is predicted to still fit
+
+        Frame times are assumed to scale with the detail. Between the two thresholds
+        nothing changes, and after each change the window starts over, so the new
+        level is judged on its own frames only. Together that keeps the level from
+        oscillating.
+        """
+        self.budget   = 1.0 / target_fps
+        self.window   = window
+        self.headroom = headroom
+        self.level    = 0
+        self.samples  = np.zeros(window) # seconds, a ring of the last window frames
+        self.frames   = 0                # frames sampled at the current level
+        self.changes  = 0
+
+    @property
+    def scale(self):
+        return self.levels[self.level]
+
+    def update(self, busy):
+        """busy := seconds of work in the last frame. Returns True if the level changed"""
+        self.samples[self.frames % self.window] = busy
+        self.frames += 1
+        if self.frames < self.window:
+            return False
+
+        t = np.median(self.samples)
+        if t > self.budget and self.level < len(self.levels) - 1:
+            self.set_level(self.level + 1)
+        elif self.level > 0 and t * self.levels[self.level - 1] / self.scale < self.headroom * self.budget:
+            self.set_level(self.level - 1)
+        else:
+            return False
+        return True
+
+    def set_level(self, level):
+        self.level   = level
+        self.frames  = 0
+        self.changes += 1
+
+    def count_of(self, n):
+        """How many of n items to simulate or draw at the current level"""
+        return max(1, int(round(n * self.scale)))
+
+    def line_width(self, width=2):
+        """Full width lines down to half detail, hairlines below that"""
+        return width if self.scale >= 0.5 else 1
+
+    def label(self):
+        return f'q: {self.scale:.0%}'
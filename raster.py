@@ -0,0 +1,163 @@
+import numpy as np
+import pygame
+
+#
+# Dust rasterizers. Each takes the (xs, ys, sizes) arrays from
+# stardust.project_dusts() and draws a filled circle per dust.
+#
+
+class CircleDusts():
+
+    def __init__(self, max_size=5, color=(255,255,255)):
+        self.color = color
+
+    def draw(self, screen, points):
+        """One pygame.draw.circle per dust"""
+        color = self.color
+        circle = pygame.draw.circle
+        for x, y, size in zip(*points):
+            circle(screen, color, (x, y), size)
+
+
+class SpriteDusts():
+
+    def __init__(self, max_size=5, color=(255,255,255)):
+        """
+        One pre-rendered circle sprite per integer radius up to max_size.
+
+        pygame.draw.circle truncates both the center and the radius to ints, so
+        blitting the sprite of int(size) at int(x) - radius, int(y) - radius draws
+        exactly the same pixels.
+        """
+        self.max_size = int(max_size)
+        self.sprites  = []
+        for r in range(self.max_size + 1):
+            sprite = pygame.Surface((2*r + 1, 2*r + 1))
+            sprite.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            pygame.draw.circle(sprite, color, (r, r), r)
+            self.sprites.append(sprite)
+
+    def draw(self, screen, points):
+        """All the dusts in a single Surface.blits call"""
+        xs, ys, sizes = points
+        radii = np.clip(sizes, 0, self.max_size).astype(int)
+        shown = radii > 0 # A circle of radius 0 draws nothing
+        radii = radii[shown]
+        xs = xs[shown].astype(int) - radii
+        ys = ys[shown].astype(int) - radii
+
+        sprites = self.sprites
+        screen.blits([ (sprites[r], (x, y)) for r, x, y in zip(radii.tolist(), xs.tolist(), ys.tolist()) ],
+                     doreturn=False)
+
+
+class PixelDusts():
+
+    def __init__(self, max_size=5, color=(255,255,255)):
+        """
+        Scatters the dusts straight into the surface's pixel array. The pixel
+        offsets of each integer radius are taken from the same circles SpriteDusts
+        blits, so the result matches pygame.draw.circle.
+        """
+        self.max_size = int(max_size)
+        self.color    = color
+        self.offsets  = [ None ]
+        for sprite in SpriteDusts(max_size, (255,255,255)).sprites[1:]:
+            r = sprite.get_width() // 2
+            dx, dy = np.nonzero(pygame.surfarray.array2d(sprite) != sprite.get_colorkey()[0])
+            self.offsets.append((dx - r, dy - r))
+
+    def draw(self, screen, points):
+        xs, ys, sizes = points
+        radii = np.clip(sizes, 0, self.max_size).astype(int)
+        xs = xs.astype(int)
+        ys = ys.astype(int)
+        w, h = screen.get_size()
+
+        # A single mapped int per pixel is much cheaper to scatter than 3 bytes
+        if screen.get_bytesize() == 4:
+            pixels = pygame.surfarray.pixels2d(screen)
+            color  = screen.map_rgb(self.color)
+        else:
+            pixels = pygame.surfarray.pixels3d(screen)
+            color  = self.color
+
+        for r in range(1, self.max_size + 1):
+            bucket = radii == r
+            if not bucket.any():
+                continue
+            x, y = xs[bucket], ys[bucket]
+            dx, dy = self.offsets[r]
+            # Only the dusts near the edges need their pixels bounds checked
+            inside = (x >= r) & (x < w - r) & (y >= r) & (y < h - r)
+            pixels[(x[inside,None] + dx).ravel(), (y[inside,None] + dy).ravel()] = color
+            edge = ~inside
+            if edge.any():
+                scatter_points(pixels, (x[edge,None] + dx).ravel(), (y[edge,None] + dy).ravel(), color)
+        del pixels
+
+
+DUST_RASTERS = {
+    'circle' : CircleDusts,
+    'sprite' : SpriteDusts,
+    'pixels' : PixelDusts,
+}
+
+#
+# Scatter rasterization into a (width, height, 3) pixels3d array
+#
+
+def scatter_points(pixels, xs, ys, colors):
+    """colors is one color or one per point"""
+    w, h = pixels.shape[:2]
+    inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+    if np.ndim(colors) > 1:
+        colors = colors[inside]
+    pixels[xs[inside], ys[inside]] = colors
+
+def clip_segments(p1, p2, w, h):
+    """
+    Liang-Barsky clipping of (N,2) segments to the [0,w) x [0,h) screen.
+    Returns the clipped end points and the mask of the segments kept.
+    """
+    d = p2 - p1
+    t0 = np.zeros(len(p1))
+    t1 = np.ones(len(p1))
+    keep = np.ones(len(p1), dtype=bool)
+    for p, q in ((-d[:,0], p1[:,0]), (d[:,0], w - 1 - p1[:,0]),
+                 (-d[:,1], p1[:,1]), (d[:,1], h - 1 - p1[:,1])):
+        parallel = p == 0
+        keep &= ~(parallel & (q < 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(parallel, 0, q / np.where(parallel, 1, p))
+        t0 = np.where(~parallel & (p < 0), np.maximum(t0, t), t0)
+        t1 = np.where(~parallel & (p > 0), np.minimum(t1, t), t1)
+    keep &= t0 <= t1
+    return (p1 + t0[:,None] * d)[keep], (p1 + t1[:,None] * d)[keep], keep
+
+def scatter_lines(pixels, p1, p2, colors, width=1):
+    """
+    DDA rasterization of (N,2) segments all at once, width pixels thick.
+    colors is one color or an (N,3) array.
+    """
+    w, h = pixels.shape[:2]
+    p1, p2, keep = clip_segments(np.asarray(p1, dtype=np.float64), np.asarray(p2, dtype=np.float64), w, h)
+    if np.ndim(colors) > 1:
+        colors = np.asarray(colors)[keep]
+    if not len(p1):
+        return
+
+    d = p2 - p1
+    steps = np.rint(np.abs(d).max(axis=1)).astype(int) + 1   # pixels per segment
+    seg = np.repeat(np.arange(len(p1)), steps)
+    first = np.cumsum(steps) - steps
+    t = (np.arange(steps.sum()) - first[seg]) / np.maximum(steps - 1, 1)[seg]
+    xs = np.rint(p1[seg,0] + d[seg,0] * t).astype(int)
+    ys = np.rint(p1[seg,1] + d[seg,1] * t).astype(int)
+    c = colors[seg] if np.ndim(colors) > 1 else colors
+
+    # Thicken across the major axis: x for steep segments, y for shallow ones
+    steep = (np.abs(d[:,1]) > np.abs(d[:,0]))[seg]
+    for o in range(width):
+        offset = o - (width - 1) // 2
+        scatter_points(pixels, xs + offset * steep, ys + offset * ~steep, c)
@@ -4,6 +4,8 @@ import pygame
 
 from matrix import *
 from camera import Camera
+from culling import frustum_planes
+from raster import scatter_lines
 
 class Renderer():
 
@@ -19,17 +21,30 @@ class Renderer():
         into a 3D vector, resulting in the vertex finally being in normalized device coordinates.
 
         Finally, turn the normalized device coordinates into screen coordinates for rendering.
+
+        The device matrix leaves w alone, so it is premultiplied into the bottom of the stack
+        (Device⋅P), the view matrix sits above it, and model matrices are pushed on top.
         """
 
         self.screen   = screen
+        self.line_width  = 2
+        self.line_raster = 'draw' # 'draw': pygame.draw.line, 'pixels': scattered into pixels3d
         self.origin_x = origin_x
         self.origin_y = origin_y
 
         self.stack          = [] # Storing a stack of transformation matrices
+        self.prefix         = [] # prefix[i] := stack[0]⋅stack[1]⋅...⋅stack[i]
         self.depth          = 0  # Number of matrices in the stack
 
-        self.render_matrix  = None # The current composite transformation matrix
-        self.last_render    = []   # Previous composite transformation matrices to restore during stack pops
+        self.render_matrix  = None # The current composite transformation matrix, prefix[-1]
+
+        self.perspective    = None
+        self.device         = None
+        self.planes         = None # Frustum planes of the view on the stack, see frustum_planes()
+        self.planes_view    = None
+
+        self.prefix_buffers = [] # Preallocated prefix products, one 4x4 per level above 0
+        self.workspaces     = {} # Scratch arrays for project() and project_instances()
 
         #
         # Camera. View Matrix
@@ -62,6 +77,7 @@ class Renderer():
         ])
         # The two transformations will make +Y Up, +X Right, +Z Into Screen
         # self.device = matmul(self.device, rot_matrix(r=180))
+        self._load_projection()
 
         
     def set_perspective_projection_matrix(self, n, f, aspect, fov):
@@ -85,7 +101,19 @@ class Renderer():
            [   0,          0,            -1,            0 ],
         ])
 
-        self.push_matrix(self.perspective, "Perspective") # Perspective Views
+        self._load_projection()
+
+
+    def _load_projection(self):
+        # Device⋅P at the bottom of the stack, once both are known
+        if self.perspective is None or self.device is None:
+            return
+        projection = matmul(self.device, self.perspective)
+        self.planes_view = None
+        if self.depth == 0:
+            self.push_matrix(projection, "Device.Perspective")
+        else:
+            self.load_matrix(0, projection)
 
 
     def _test_matrices(self):
@@ -99,61 +127,174 @@ class Renderer():
         print("Projected\n",np.round(vC/vC[3,], 3))
 
 
-    def cal_render_matrix(self):
-        if self.depth == 1:
-            self.render_matrix = self.stack[0]
-        elif self.depth > 1:
-            b = None        
-            for s in reversed(self.stack):
-                b = s if b is None else matmul(s, b)
-            self.render_matrix = b
+    def workspace(self, name, shape):
+        """
+        A DTYPE scratch array reused from frame to frame. One is kept per name and
+        trailing shape, grown along the first axis as needed; the result is a view
+        of its first shape[0] rows.
+        """
+        key = (name, shape[1:])
+        buf = self.workspaces.get(key)
+        if buf is None or len(buf) < shape[0]:
+            buf = self.workspaces[key] = np.empty(shape, dtype=DTYPE)
+        return buf[:shape[0]]
+
+
+    def prefix_buffer(self, level):
+        while len(self.prefix_buffers) <= level:
+            self.prefix_buffers.append(np.empty((4,4), dtype=DTYPE))
+        return self.prefix_buffers[level]
+
+
+    def cal_render_matrix(self, level=0):
+        """Recompose the cached prefix products from level upwards"""
+        for i in range(level, self.depth):
+            self.prefix[i] = self.stack[0] if i == 0 else matmul(self.prefix[i-1], self.stack[i], out=self.prefix_buffer(i))
+        self.render_matrix = self.prefix[-1] if self.depth else None
 
 
     def push_matrix(self, matrix, label=None):
         if label and False:
             print("Push ", label)
         self.stack.append(matrix)
-        if self.render_matrix is not None:
-            self.last_render.append(self.render_matrix)
+        # A single multiply against the cached composite below, into the level's buffer
+        self.prefix.append(matrix if self.depth == 0 else matmul(self.render_matrix, matrix, out=self.prefix_buffer(self.depth)))
         self.depth +=1
-        self.cal_render_matrix()
+        self.render_matrix = self.prefix[-1]
 
 
     def pop_matrix(self):
         m = self.stack.pop()
+        self.prefix.pop()
         self.depth -= 1
-        if self.depth > 1:
-            self.render_matrix = self.last_render.pop()
-        # return m
+        self.render_matrix = self.prefix[-1] if self.depth else None
+        return m
+
+
+    def load_matrix(self, level, matrix):
+        """Replace the matrix at a level of the stack"""
+        self.stack[level] = matrix
+        self.cal_render_matrix(level)
 
         
-    def begin_draw(self):
-        if self.camera.view_has_changed():
-          if self.depth == 2: # Lazy pop; Handle a previous View Matrix
-              self.pop_matrix()
-          self.push_matrix(self.camera.get_view_matrix(), label="View")
+    def begin_draw(self, alpha=None):
+        """alpha, if given, interpolates the camera within the last simulation step"""
+        # Discard anything left above the view matrix
+        while self.depth > 2:
+            self.pop_matrix()
+
+        if self.depth < 2:
+            self.push_matrix(self.camera.get_view_matrix(alpha), label="View")
+        elif self.camera.view_has_changed() or (alpha is not None and self.camera.is_moving()):
+            # Only Device⋅P⋅V is recomposed, and only when the camera has moved
+            self.load_matrix(1, self.camera.get_view_matrix(alpha))
         return
     
     def end_draw(self):        
-        # Lazy pop handle in begin_draw
-        # no need to change if the view matrix hasn't changed
-        # self.pop_matrix()
+        # The view matrix stays on the stack for the next frame
         return
 
-    def project(self, vectors):
+    def frustum_planes(self):
+        """World space frustum planes, from P⋅V, recalculated only when the view changes"""
+        view = self.stack[1]
+        if self.planes_view is not view:
+            # Visible points come out of P⋅V with w < 0 here (the camera looks down +z),
+            # negating the matrix gives the usual -w <= x,y,z <= w frustum
+            self.planes      = frustum_planes(-matmul(self.perspective, view))
+            self.planes_view = view
+        return self.planes
+
+    def project(self, vectors, divide=True):
         """
         matmul render_matrix against the vertices in bulk.
         vertices shall be in column format (4, <num_vertices>)
-        returns results after perspective division in device coords
+        returns results after perspective division in device coords, or before it,
+        in device-homogeneous coords, when not divide (see clip_lines()).
+
+        The result is a view of a workspace, valid until the next project() of as
+        many vertices.
         """
-        v = np.copy(vectors)
+        m = self.render_matrix
+        q = self.workspace('project', (4, vectors.shape[1]))
+        matmul(m, vectors, out=q)
+        if not divide:
+            return q.transpose()
+
+        # Add a small z to avoid division by zero, M⋅(v + ε⋅z) = M⋅v + ε⋅M[:,2]
+        e = self.workspace('project_e', (4, 1))
+        np.multiply(m[:,2:3], epsilon, out=e)
+        q += e
+        # perspective division
+        np.divide(q[:3], q[3], out=q[:3])
+        q[3] = 1
+
+        return q.transpose()
+
+    def project_instances(self, models, vectors, divide=True):
+        """
+        Project the same vertices through a stack of model matrices in one batch.
+        models shall be (<num_instances>, 4, 4), vertices in column format (4, <num_vertices>)
+        returns (<num_instances>, <num_vertices>, 4) after perspective division in device coords,
+        or before it when not divide, a view of a workspace valid until the next call.
+        """
+        n, v = len(models), vectors.shape[1]
+        mv = self.workspace('instances_mv', (n, 4, 4))
+        q  = self.workspace('instances',    (n, 4, v))
+        # (4,4) . (N,4,4) . (4,V) => (N,4,V)
+        matmul(self.render_matrix, models, out=mv)
+        matmul(mv, vectors, out=q)
+        if not divide:
+            return q.transpose(0, 2, 1)
+
+        e  = self.workspace('instances_e',  (n, 4, 1))
+        w  = self.workspace('instances_w',  (n, 1, v))
         # Add a small z to avoid division by zero
-        v[2,:] += epsilon
-        q = matmul(self.render_matrix, v)
-        q = q / q[(3,)] # perspective division
-        s = matmul(self.device, q)
+        np.multiply(mv[:,:,2:3], epsilon, out=e)
+        q += e
+        # perspective division, w is copied out so that the divide does not overlap itself
+        np.copyto(w, q[:,3:4])
+        np.divide(q[:,:3], w, out=q[:,:3])
+        q[:,3] = 1
+
+        return q.transpose(0, 2, 1)
+
+    def clip_lines(self, v1, v2):
+        """
+        Clip a batch of segments against the view frustum before the perspective division.
+        v1, v2 are the (<num_lines>, 4) end points in device-homogeneous coords, as returned
+        by project(divide=False).
+
+        Visible points have w < 0 here; negated, as the division does not mind, the
+        frustum is the near and far planes plus the screen edges:
+
+            0 <= x <= 2⋅origin_x⋅w,  0 <= y <= 2⋅origin_y⋅w,  -w <= z <= w
 
-        return s.transpose()
+        Each segment is cut to the portion inside all six (Liang-Barsky on the signed
+        distances), so edges through the near plane are shortened rather than dropped,
+        and w > 0 is left for the division. Returns the (<num_kept>, 3) end points after
+        perspective division in device coords, and the mask of the segments kept.
+        """
+        p1, p2 = -np.asarray(v1, dtype=DTYPE), -np.asarray(v2, dtype=DTYPE)
+        sx, sy = 2*self.origin_x, 2*self.origin_y
+
+        def distances(p):
+            x, y, z, w = p[:,0], p[:,1], p[:,2], p[:,3]
+            return np.stack((x, sx*w - x, y, sy*w - y, w + z, w - z), axis=1)
+
+        d1, d2 = distances(p1), distances(p2)
+        out1, out2 = d1 < 0, d2 < 0
+        keep = ~(out1 & out2).any(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = d1 / (d1 - d2) # Where the segment crosses each plane
+        t0 = np.where(out1, t, 0).max(axis=1)
+        t1 = np.where(out2, t, 1).min(axis=1)
+        keep &= t0 <= t1
+
+        p1, p2 = p1[keep], p2[keep]
+        d = p2 - p1
+        q1 = p1 + t0[keep,None] * d
+        q2 = p1 + t1[keep,None] * d
+        return q1[:,:3] / q1[:,3:], q2[:,:3] / q2[:,3:], keep
         
     def draw_line(self, v1, v2, color=(255,255,255)):
 
@@ -164,10 +305,54 @@ class Renderer():
         s1 = np.rint(v1[:2]).astype(int)
         s2 = np.rint(v2[:2]).astype(int)
 
-        pygame.draw.line(self.screen, color, s1, s2, 2)
+        pygame.draw.line(self.screen, color, s1, s2, self.line_width)
+
+    def draw_lines(self, v1, v2, colors=(255,255,255)):
+        """
+        Draw a batch of line segments.
+        v1, v2 are the (<num_lines>, >=3) end points in device coords, as returned by project()
+        colors is either one color or a (<num_lines>, 3) array of colors
+        """
+        # Clipping, whole segments only
+        z1, z2 = v1[:,2], v2[:,2]
+        visible = (z1 >= -1) & (z2 >= -1) & (z1 <= 1) & (z2 <= 1)
+        if np.ndim(colors) > 1:
+            colors = np.asarray(colors)[visible]
+        self._raster_lines(v1[visible,:2], v2[visible,:2], colors)
+
+    def draw_clipped_lines(self, v1, v2, colors=(255,255,255)):
+        """
+        Draw the visible portions of a batch of line segments.
+        v1, v2 are the (<num_lines>, 4) end points in device-homogeneous coords, as returned
+        by project(divide=False), see clip_lines()
+        """
+        s1, s2, keep = self.clip_lines(v1, v2)
+        if np.ndim(colors) > 1:
+            colors = np.asarray(colors)[keep]
+        self._raster_lines(s1[:,:2], s2[:,:2], colors)
+
+    def _raster_lines(self, s1, s2, colors):
+        s1 = np.rint(s1).astype(int)
+        s2 = np.rint(s2).astype(int)
+
+        if self.line_raster == 'pixels':
+            pixels = pygame.surfarray.pixels3d(self.screen)
+            scatter_lines(pixels, s1, s2, colors, self.line_width)
+            del pixels
+            return
+
+        line = pygame.draw.line
+        screen = self.screen
+        width = self.line_width
+        if np.ndim(colors) == 1:
+            for p1, p2 in zip(s1.tolist(), s2.tolist()):
+                line(screen, colors, p1, p2, width)
+        else:
+            for color, p1, p2 in zip(colors.tolist(), s1.tolist(), s2.tolist()):
+                line(screen, color, p1, p2, width)
 
 
     def draw_point(self, pt=[0,0,0,1], color=(255,255,255)):
-        p1 = np.rint( matmul(self.render_matrix, pt)).astype(int)
+        p1 = np.rint( self.project(np_array(pt).reshape(4, 1))[0] ).astype(int)
         pygame.draw.circle(self.screen, color, p1[:2], 2)
 
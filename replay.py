@@ -0,0 +1,218 @@
+"""
+Deterministic input recording and headless replay.
+
+Run a demo with --record to log the RNG seed and the control state of every
+simulation step, then re-run the log headlessly, as fast as possible:
+
+    $ python stardust.py --record flight.log
+    $ python replay.py flight.log
+
+The replay ends in a bit-identical dust (or camera and cube) state, which is
+checked against the digest stored at the end of the log.
+"""
+import os
+import sys
+import time
+import json
+import struct
+import hashlib
+import argparse
+
+import numpy as np
+
+STARDUST = 0
+CUBES    = 1
+
+MAGIC   = b'SDRL'
+VERSION = 2
+
+# magic, version, kind, simulation hz, seed, initial number of dusts (or cubes)
+HEADER = struct.Struct('<4sBBHII')
+FOOTER = struct.Struct('<4s32s') # b'END!', sha256 of the final state
+
+RECORDS = {
+    # resets := number of Stardust.set_view() calls since the previous step
+    # move   := 0 only for a last record that carries the resets after the final step
+    # dusts  := number of dusts during the step, see QualityController
+    STARDUST : np.dtype([('view', 'u1'), ('resets', 'u1'), ('move', 'u1'), ('dusts', '<u4'),
+                         ('speed', '<f8'), ('alpha', '<f8'), ('beta', '<f8')]),
+    # The camera delta applied during the step
+    CUBES    : np.dtype([('r', '<f8'), ('p', '<f8'), ('y', '<f8'), ('xo', '<f8'), ('yo', '<f8'), ('zo', '<f8')]),
+}
+
+def new_seed():
+    return int.from_bytes(os.urandom(4), 'little')
+
+def stardust_digest(stardust):
+    h = hashlib.sha256()
+    h.update(bytes([stardust.travel_view.value]))
+    # Whole numbers, hashed as int64 whatever the dtype they are simulated in
+    h.update(np.ascontiguousarray(stardust.dusts, dtype=np.int64).tobytes())
+    return h.digest()
+
+def cubes_digest(camera, cubes):
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(camera.rotation).tobytes())
+    h.update(np.ascontiguousarray(camera.translation).tobytes())
+    h.update(np.ascontiguousarray(cubes.model_matrices).tobytes())
+    return h.digest()
+
+
+class Recorder():
+
+    flush_every = 1024 # records
+
+    def __init__(self, path, kind, seed, sim_hz, count=0):
+        self.file    = open(path, 'wb')
+        self.dtype   = RECORDS[kind]
+        self.records = []
+        self.resets  = 1 # Stardust() resets once on construction, the replay does the same
+        self.file.write(HEADER.pack(MAGIC, VERSION, kind, sim_hz, seed, count))
+
+    def record(self, *fields):
+        self.records.append(fields)
+        if len(self.records) >= self.flush_every:
+            self.flush()
+
+    def record_stardust(self, stardust, controls, move=True):
+        self.record(stardust.travel_view.value, stardust.resets - self.resets, move, stardust.num_dusts,
+                    controls.step_speed(), controls.alpha, controls.beta)
+        self.resets = stardust.resets
+
+    def close_stardust(self, stardust, controls):
+        if stardust.resets != self.resets:
+            self.record_stardust(stardust, controls, move=False)
+        self.close(stardust_digest(stardust))
+
+    def record_cubes(self, d):
+        self.record(d.r_delta, d.p_delta, d.y_delta, d.xo_delta, d.yo_delta, d.zo_delta)
+
+    def flush(self):
+        if self.records:
+            np.array(self.records, dtype=self.dtype).tofile(self.file)
+            self.records = []
+
+    def close(self, digest):
+        self.flush()
+        self.file.write(FOOTER.pack(b'END!', digest))
+        self.file.close()
+
+
+def read_log(path):
+    """Returns kind, seed, sim_hz, the initial count, records and the final state digest"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, version, kind, sim_hz, seed, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a version {VERSION} recording")
+
+    end, digest = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+    if end != b'END!':
+        raise ValueError(f"{path}: truncated recording")
+
+    records = np.frombuffer(data[HEADER.size:len(data) - FOOTER.size], dtype=RECORDS[kind])
+    return kind, seed, sim_hz, count, records, digest
+
+
+def step_stardust(stardust, r):
+    """Apply one stardust record, False if it carries no simulation step"""
+    from stardust import View
+
+    for i in range(r['resets']):
+        stardust.set_view(View(int(r['view'])))
+    if not r['move']:
+        return False
+    stardust.resize(int(r['dusts']))
+    stardust.move_dusts(float(r['alpha']), float(r['beta']), float(r['speed']))
+    return True
+
+def step_cubes(camera, cubes, r):
+    """Apply one cube scene record"""
+    camera.set_camera_delta(*(float(v) for v in r))
+    cubes.update()
+    return True
+
+def replay_stardust(seed, count, records, screen=None):
+    from stardust import Stardust, WIDTH, HEIGHT, project_dusts
+    from raster import PixelDusts
+
+    np.random.seed(seed)
+    stardust = Stardust(WIDTH, HEIGHT, num_dusts=count)
+    raster   = PixelDusts(Stardust.max_dust_size)
+    for r in records:
+        if not step_stardust(stardust, r):
+            break
+        if screen is not None:
+            screen.fill((0, 0, 0))
+            raster.draw(screen, project_dusts(stardust))
+    return stardust_digest(stardust)
+
+def replay_cubes(seed, count, records, screen=None, hz=30):
+    from camera import Camera
+    from renderer import Renderer
+    from projection_test import create_cubes, WIDTH, HEIGHT
+
+    np.random.seed(seed)
+    if screen is not None:
+        paint = Renderer(screen, WIDTH/2, HEIGHT/2)
+        camera = paint.camera
+    else:
+        camera = Camera()
+    cubes = create_cubes([], hz=hz)
+    for r in records:
+        step_cubes(camera, cubes, r)
+        if screen is not None:
+            screen.fill((0, 0, 0))
+            paint.begin_draw()
+            cubes.draw(paint)
+            paint.end_draw()
+    return cubes_digest(camera, cubes)
+
+def replay(path, draw=False):
+    kind, seed, sim_hz, count, records, digest = read_log(path)
+
+    # The scene modules, and pygame through them, are imported before the timing,
+    # not lazily inside it, so that steps_per_s compares the simulation alone
+    import pygame
+    import stardust, raster, camera, renderer, projection_test
+
+    screen = None
+    if draw:
+        screen = pygame.Surface((stardust.WIDTH, stardust.HEIGHT))
+
+    t0 = time.perf_counter()
+    if kind == STARDUST:
+        result = replay_stardust(seed, count, records, screen) # Speeds are recorded per step
+    else:
+        result = replay_cubes(seed, count, records, screen, sim_hz)
+    seconds = time.perf_counter() - t0
+
+    return {
+        'scene'     : 'stardust' if kind == STARDUST else 'cubes',
+        'seed'      : seed,
+        'count'     : count,
+        'sim_hz'    : sim_hz,
+        'steps'     : len(records),
+        'seconds'   : round(seconds, 4),
+        'steps_per_s' : round(len(records) / seconds, 1) if seconds else None,
+        'digest'    : result.hex(),
+        'identical' : result == digest,
+    }
+
+def main():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('log')
+    parser.add_argument('--draw', action='store_true', help='Also rasterize every step offscreen')
+    args = parser.parse_args()
+
+    result = replay(args.log, args.draw)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    sys.exit(0 if result['identical'] else 1)
+
+if __name__ == '__main__':
+    main()
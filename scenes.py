@@ -0,0 +1,71 @@
+import math
+import numpy as np
+
+from stardust import Stardust, View, project_dusts
+from raster import DUST_RASTERS
+from renderer import Renderer
+from unitcube import UnitCube, UnitCubes
+
+#
+# The per-frame pipelines of stardust.py and projection_test.py without the
+# event loop, display or HUD, so that they can be driven headlessly.
+#
+
+class StardustScene():
+
+    def __init__(self, screen, num_dusts=Stardust.num_dusts,
+                 alpha=0.0175, beta=0.00875, speed=10.0, view=View.FRONT, raster='pixels'):
+        self.screen   = screen
+        self.raster   = DUST_RASTERS[raster](Stardust.max_dust_size)
+        self.stardust = Stardust(*screen.get_size(), num_dusts=num_dusts)
+        self.stardust.set_view(view)
+        self.alpha, self.beta, self.speed = alpha, beta, speed
+
+    def update(self):
+        self.stardust.move_dusts(self.alpha, self.beta, self.speed)
+
+    def draw(self):
+        self.screen.fill((0, 0, 0))
+        self.raster.draw(self.screen, project_dusts(self.stardust))
+
+
+class CubeScene():
+
+    def __init__(self, screen, num_cubes=110, lines='draw'):
+        w, h = screen.get_size()
+        self.screen = screen
+        self.paint  = Renderer(screen, w/2, h/2)
+        self.paint.line_raster = lines
+        self.cubes  = UnitCubes(cube_grid(num_cubes))
+
+    def update(self):
+        self.cubes.update()
+
+    def draw(self):
+        self.screen.fill((0, 0, 0))
+        self.paint.begin_draw()
+        self.cubes.draw(self.paint)
+        self.paint.end_draw()
+
+
+def cube_grid(num_cubes, step=2, front=1.5):
+    """
+    num_cubes UnitCubes laid out row by row on a square grid in front of the
+    camera, the same spacing as create_cubes() in projection_test.py
+    """
+    columns = max(1, math.ceil(math.sqrt(num_cubes)))
+    left = -(columns - 1) * step / 2
+    return [ UnitCube(i % columns * step + left, 0.5, i // columns * step + front)
+             for i in range(num_cubes) ]
+
+
+SCENES = {
+    'stardust' : StardustScene,
+    'cubes'    : CubeScene,
+}
+
+def create_scene(name, screen, count=None):
+    """A scene by name, count being its number of dusts or cubes"""
+    if count is None:
+        return SCENES[name](screen)
+    return SCENES[name](screen, count)
@@ -0,0 +1,47 @@
+import time
+
+# The step rate the per-step amounts of the demos (speeds, spins, key deltas)
+# were tuned at. At other rates they are scaled by REFERENCE_HZ / hz, so that
+# the step rate only changes the precision of the simulation, not its pace.
+REFERENCE_HZ = 30
+
+class SimClock():
+
+    def __init__(self, hz=30, max_steps=5):
+        """
+        Fixed-timestep simulation clock, decoupling the simulation from the render rate.
+
+        Each rendered frame, advance() adds the elapsed wall time to an accumulator and
+        returns how many fixed steps of 1/hz seconds to simulate. Whatever is left over is
+        alpha, the fraction of a step to interpolate by when rendering.
+
+        max_steps caps the catch-up after a stall, dropping the excess time rather than
+        spiralling into ever longer frames.
+        """
+        self.hz        = hz
+        self.step      = 1.0 / hz
+        self.max_steps = max_steps
+        self.reset()
+
+    def reset(self):
+        """Forget the elapsed time, e.g. after a pause"""
+        self.last        = None
+        self.accumulator = 0.0
+        self.steps       = 0 # Total number of steps taken
+
+    def advance(self, now=None):
+        now = time.perf_counter() if now is None else now
+        if self.last is not None:
+            self.accumulator += now - self.last
+        self.last = now
+
+        steps = int(self.accumulator / self.step)
+        self.accumulator -= steps * self.step
+        if steps > self.max_steps:
+            steps = self.max_steps
+        self.steps += steps
+        return steps
+
+    @property
+    def alpha(self):
+        return min(self.accumulator / self.step, 1.0)
@@ -1,8 +1,20 @@
+from startup import StartupTimer, init_pygame, system_font
 from enum import Enum
+import copy
+import argparse
 import pygame
 import numpy as np
 from numpy.random import random, randint
 
+from profiler import FrameProfiler
+from simclock import SimClock, REFERENCE_HZ
+import replay
+from raster import DUST_RASTERS
+from dirty import DirtyRects, dust_rects
+from quality import QualityController
+from pipeline import Pipeline
+from hud import Hud
+
 WIDTH =800
 HEIGHT=600
 np.seterr(all='raise') # For development
@@ -16,93 +28,238 @@ class View(Enum):
 class Stardust():
     
     max_dust_z    = 500
+    max_dust_size = 5
     num_dusts     = 15
     epsilon       = 1e-10
+    # Dust positions are whole numbers, kept as floats so that every move is done
+    # in place. float64 rather than matrix.DTYPE: epsilon vanishes in float32.
+    dtype         = np.float64
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, num_dusts=None):
+        """
+        Dusts are held as a structure of arrays: self.dusts is (3, num_dusts) with
+        rows x, y, z, so that every dust is moved in one batched step per frame.
+        The moves and projections write into preallocated buffers, see allocate().
+        """
         self.width, self.height      = width, height
         self.origin_x, self.origin_y = np.rint(width/2), np.rint(height/2)
         self.qtr_x, self.qtr_y       = np.rint(width/4), np.rint(height/4)
+        if num_dusts is not None:
+            self.num_dusts = num_dusts
+        self.resets = 0 # Number of reset_dusts() calls, each one draws from the RNG
+        self.allocate(self.num_dusts)
         self.set_view(View.FRONT)
+
+    def allocate(self, capacity):
+        """
+        Buffers for up to capacity dusts, reused by every move_dusts() and
+        project_dusts(). self.dusts, self.previous, ... are views of the first
+        num_dusts of each.
+        """
+        self.buffers = {
+            'dusts'     : np.zeros((3, capacity), dtype=self.dtype),
+            'previous'  : np.zeros((3, capacity), dtype=self.dtype), # Dusts before the last move, for interpolation
+            'respawned' : np.zeros(capacity, dtype=bool),
+            'outside'   : np.zeros(capacity, dtype=bool),            # Temporary of off_screen()
+            'scratch'   : np.zeros((4, capacity), dtype=self.dtype), # Temporaries of move_dusts()
+            'lerp'      : np.zeros((3, capacity), dtype=self.dtype), # interpolated()
+            'points'    : np.zeros((3, capacity), dtype=self.dtype), # project_dusts()
+        }
+        self.take_views()
+
+    def take_views(self):
+        for name, buf in self.buffers.items():
+            setattr(self, name, buf[..., :self.num_dusts])
+
+    def capacity(self):
+        return self.buffers['dusts'].shape[1]
+
+    def resize(self, n):
+        """
+        Change the number of dusts in place. Dropped dusts are forgotten and new
+        ones spawned; the buffers are only reallocated, doubling, when n exceeds
+        their capacity.
+        """
+        old = self.num_dusts
+        if n == old:
+            return
+        if n > self.capacity():
+            buffers = self.buffers
+            self.allocate(max(n, 2 * self.capacity()))
+            for name, buf in buffers.items():
+                self.buffers[name][..., :old] = buf[..., :old]
+
+        self.num_dusts = n
+        self.take_views()
+        if n > old:
+            self.dusts[:, old:]    = self.spawn_dusts(n - old)
+            self.previous[:, old:] = self.dusts[:, old:]
+            self.respawned[old:]   = False
+
+    def __getstate__(self):
+        # The views are taken again from the buffers after unpickling
+        return { k: v for k, v in self.__dict__.items() if k not in self.buffers }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.take_views()
         
     def set_view(self, view):
         self.travel_view = view
         self.reset_dusts()
         
     def reset_dusts(self):
-        self.dusts      = np.array([ self.spawn_dust() for i in range( self.num_dusts )])
+        self.resets      += 1
+        self.dusts[:]     = self.spawn_dusts(self.num_dusts)
+        self.previous[:]  = self.dusts
+        self.respawned[:] = False
 
-    def spawn_dust(self):
+    def spawn_dusts(self, n):
         # dusts can orginate anywhere on the screen
         w, h, z, ox, oy = self.width, self.height, self.max_dust_z, self.origin_x, self.origin_y
-        nums = np.random.rand(3) * [w, h, z] - [ox, oy, 0]
-        nums = np.append( nums, 1) # For matrix multiplication
-        return np.rint(nums).astype(int) 
+        nums = np.random.rand(3, n) * [[w], [h], [z]] - [[ox], [oy], [0]]
+        return np.rint(nums)
+
+    def spawn_dust(self):
+        return self.spawn_dusts(1)[:, 0]
+
+    def off_screen(self, x, y, z, out=None):
+        """Boolean mask of the dusts that have left the view volume, written into out if given"""
+        if out is None:
+            return ((x >  self.origin_x -1) |
+                    (x <= self.origin_x*-1) |
+                    (y >  self.origin_y -1) |
+                    (y <= self.origin_y*-1) |
+                    (z >  self.max_dust_z)  |
+                    (z < 1))
+        t = self.outside
+        np.greater(x, self.origin_x -1, out=out)
+        out |= np.less_equal(x, self.origin_x*-1, out=t)
+        out |= np.greater(y, self.origin_y -1, out=t)
+        out |= np.less_equal(y, self.origin_y*-1, out=t)
+        out |= np.greater(z, self.max_dust_z, out=t)
+        out |= np.less(z, 1, out=t)
+        return out
 
     def is_off_screen(self, dust):
-        return any([
-        dust[0] >  self.origin_x -1,
-        dust[0] <= self.origin_x*-1,
-        dust[1] >  self.origin_y -1,
-        dust[1] <= self.origin_y*-1,
-        dust[2] >  self.max_dust_z,
-        dust[2] < 1
-    ])
-
-    def _move_dust(self, dust, alpha, beta, speed):
-        nd = dust
-        x, y, z, _ = dust
-        z += self.epsilon # Prevent DBZ
-        x += self.epsilon # Prevent DBZ
+        return bool(self.off_screen(dust[0], dust[1], dust[2]))
+
+    def move_dusts(self, alpha, beta, speed):
+        """
+        One step of every dust, written into the buffer of the step before last,
+        which then becomes the current one. The order of every operation is that
+        of the formulas in the comments, so results do not depend on the buffering.
+        """
+        x, y, z = self.dusts
+        nd = self.previous
+        nx, ny, nz = nd
+        xe, ze, a, b = self.scratch
+        # Prevent DBZ
+        np.add(x, self.epsilon, out=xe)
+        np.add(z, self.epsilon, out=ze)
 
         s  = speed * -1 if self.travel_view == View.REAR else speed
         r_mod = -1 if self.travel_view == View.REAR or self.travel_view == View.RIGHT else 1
 
         if self.travel_view in (View.FRONT, View.REAR):
-
-            x_roll = -alpha * y * 2.4 * r_mod
-            y_roll =  alpha * x * 2.4 * r_mod
-            x_pitch = 2 * pow(beta * y / 256, 2)
-            y_pitch = -beta * 1024 * r_mod
-            q = s / z + 1
-
-            matrix = np.array([
-                [q, 0,   0, 0],
-                [0, q,   0, 0],
-                [0, 0, 1/q, 0],
-                [x_roll + x_pitch, y_roll + y_pitch, 0, 1]
-            ])
+            #
+            # [x, y, z, 1] . | q                  0                  0    0 |
+            #                | 0                  q                  0    0 |
+            #                | 0                  0                  1/q  0 |
+            #                | x_roll + x_pitch   y_roll + y_pitch   0    1 |
+            #
+            # x_roll  = -alpha * y * 2.4 * r_mod
+            # y_roll  =  alpha * xe * 2.4 * r_mod
+            # x_pitch = 2 * (beta * y / 256) ** 2
+            # y_pitch = -beta * 1024 * r_mod
+            # q = s / ze + 1
+            #
+            # nx = x * q + x_roll + x_pitch
+            # ny = y * q + y_roll + y_pitch
+            # nz = z / q
+            #
+            q = ze
+            np.divide(s, ze, out=q)
+            q += 1
+
+            np.multiply(x, q, out=nx)
+            np.multiply(y, -alpha, out=a)
+            a *= 2.4
+            a *= r_mod
+            nx += a
+            np.multiply(y, beta, out=b)
+            b /= 256
+            np.square(b, out=b)
+            b *= 2
+            nx += b
+
+            np.multiply(y, q, out=ny)
+            np.multiply(xe, alpha, out=a)
+            a *= 2.4
+            a *= r_mod
+            ny += a
+            ny += -beta * 1024 * r_mod
+
+            np.divide(z, q, out=nz)
 
         else:
             # Different to https://elite.bbcelite.com/            
-            x_roll  =  0 
-            y_roll  = -alpha * 1024 * r_mod
-            
-            x_pitch =  beta * y * r_mod
-            y_pitch = -beta * x * r_mod
-            d = -128 * s / z  * r_mod
-            
-            matrix = np.array([
-                [1, 0, 0, 0],
-                [0, 1, 0, 0],
-                [0, 0, 1, 0],
-                [d + x_roll + x_pitch, y_roll + y_pitch, 0, 1]
-            ])
-
-        nd = np.rint(np.matmul(dust, matrix)).astype(int)
-
-        if self.is_off_screen(nd):
-            nd = self.spawn_dust()
-
-        return nd
-        
-    def move_dusts(self, alpha, beta, speed):
-        for i in range(len(self.dusts)):
-            nd = self._move_dust( self.dusts[i], alpha, beta, speed )
-            self.dusts[i] = nd
-            
-    def get_dust_size(self, dust):
-        return 5/self.max_dust_z *(self.max_dust_z-dust[2])
+            #
+            # y_roll  = -alpha * 1024 * r_mod
+            # x_pitch =  beta * y * r_mod
+            # y_pitch = -beta * xe * r_mod
+            # d = -128 * s / ze  * r_mod
+            #
+            # nx = x + d + x_pitch
+            # ny = y + y_roll + y_pitch
+            # nz = z
+            #
+            np.divide(-128 * s, ze, out=a)
+            a *= r_mod
+            np.add(x, a, out=nx)
+            np.multiply(y, beta, out=b)
+            b *= r_mod
+            nx += b
+
+            np.add(y, -alpha * 1024 * r_mod, out=ny)
+            np.multiply(xe, -beta, out=b)
+            b *= r_mod
+            ny += b
+
+            nz[:] = z
+
+        np.rint(nd, out=nd)
+
+        # Replace every dust that drifted off screen in one go
+        off = self.off_screen(nx, ny, nz, out=self.respawned)
+        n_off = np.count_nonzero(off)
+        if n_off:
+            nd[:, off] = self.spawn_dusts(n_off)
+
+        self.previous = self.dusts
+        self.dusts    = nd
+        b = self.buffers
+        b['dusts'], b['previous'] = b['previous'], b['dusts']
+
+    def interpolated(self, alpha=None):
+        """
+        The dusts alpha of the way from their previous positions to the current ones.
+        Respawned dusts are not interpolated across the screen.
+        """
+        if alpha is None:
+            return self.dusts
+        d = self.lerp
+        np.subtract(self.dusts, self.previous, out=d)
+        d *= alpha
+        d += self.previous
+        np.copyto(d, self.dusts, where=self.respawned)
+        return d
+
+    def get_dust_size(self, dust, out=None):
+        return np.multiply(self.max_dust_size/self.max_dust_z, np.subtract(self.max_dust_z, dust[2], out=out), out=out)
+
+    def get_dust_sizes(self, dusts=None, out=None):
+        return self.get_dust_size(self.dusts if dusts is None else dusts, out)
 
 class FlightControls():
 
@@ -110,15 +267,19 @@ class FlightControls():
     full_pitch_s = 12
     full_roll_s  = 6
     
-    def __init__(self, fps):
+    def __init__(self, hz):
         """
+        hz   := simulation steps per second, see SimClock
+
         pitch:= 12 seconds per full rotation 360
               = 30 deg per second
-              = 1 deg / frame at 30 fps
+              = 1 deg / step at 30 hz
 
         roll := 6 seconds per full rotation 360
               = 60 per second
-              = 2 deg / frame at 30 fps
+              = 2 deg / step at 30 hz
+
+        speed:= distance per step at 30 hz, see step_speed()
         """
         
         self.speed = 10.0
@@ -126,14 +287,19 @@ class FlightControls():
         self.beta  = 0.0 
 
         self.s_max = 10.0
-        self.a_max = 360.0 / self.full_roll_s  / fps * self.degree
-        self.b_max = 360.0 / self.full_pitch_s / fps * self.degree
+        self.s_scale = REFERENCE_HZ / hz
+        self.a_max = 360.0 / self.full_roll_s  / hz * self.degree
+        self.b_max = 360.0 / self.full_pitch_s / hz * self.degree
 
         self.s_step = 0.5
         self.a_step = self.a_max / 16
         self.b_step = self.b_max / 16
         print(self.a_step, self.b_step)
         
+    def step_speed(self):
+        """Distance of one simulation step at hz"""
+        return self.speed * self.s_scale
+
     def roll_left(self):
         self.alpha = min(round(self.alpha + self.a_step, 5), self.a_max) if self.alpha >= 0 else 0
         
@@ -152,22 +318,86 @@ class FlightControls():
     def slower(self):
         self.speed = max(round( self.speed - self.s_step, 2), self.s_step)
 
+def project_dusts(stardust, alpha=None):
+    """Screen positions and sizes of the dusts, interpolated by alpha of a simulation step"""
+    dusts = stardust.interpolated(alpha)
+    xs, ys, sizes = stardust.points
+    np.add(dusts[0], stardust.origin_x, out=xs)
+    np.add(dusts[1], stardust.origin_y, out=ys)
+    stardust.get_dust_sizes(dusts, out=sizes)
+    return xs, ys, sizes
+
 def main():
 
-    pygame.init()
+    parser = argparse.ArgumentParser(description="Stardust")
+    parser.add_argument('--profile-csv', help='Write per-stage frame timings to this CSV file on exit')
+    parser.add_argument('--sim-hz',  type=int, default=30, help='Simulation steps per second')
+    parser.add_argument('--max-fps', type=int, default=30, help='Render frame rate cap, 0 for uncapped')
+    parser.add_argument('--seed',    type=int, help='Seed for the random dusts')
+    parser.add_argument('--record',  help='Record the seed and controls to this file for replay.py')
+    parser.add_argument('--dusts',   type=int, default=Stardust.num_dusts, help='Number of dusts')
+    parser.add_argument('--raster',  choices=sorted(DUST_RASTERS), default='pixels', help='Dust rasterizer')
+    parser.add_argument('--dirty',   action='store_true', help='Only erase and update the screen areas that changed')
+    parser.add_argument('--target-fps', type=int, help='Frame rate the adaptive quality holds, default --max-fps, 0 for fixed quality')
+    parser.add_argument('--pipeline', action='store_true', help='Simulate the next frame on a worker thread while this one is drawn')
+    parser.add_argument('--startup-report', action='store_true', help='Print the time from launch to the first frame')
+    args = parser.parse_args()
+    timer = StartupTimer()
+    timer.mark('imports')
+
+    init_pygame()
     pygame.display.set_caption("Stardust")
 
+    seed = replay.new_seed() if args.seed is None else args.seed
+    np.random.seed(seed)
+
     screen   = pygame.display.set_mode((WIDTH, HEIGHT))
-    stardust = Stardust(WIDTH, HEIGHT)
-    center   = np.array([stardust.origin_x, stardust.origin_y, 0, 0])
-    font     = pygame.font.SysFont('Courier New, courier, monospace', 20, bold=True)
-    fps = 30
-    controls = FlightControls(fps)
+    timer.mark('display')
+    stardust = Stardust(WIDTH, HEIGHT, num_dusts=args.dusts)
+    raster   = DUST_RASTERS[args.raster](Stardust.max_dust_size)
+    dirty    = DirtyRects(screen) if args.dirty else None
+    hud      = Hud(system_font('Courier New, courier, monospace', 20, bold=True))
+    timer.mark('font')
+    controls = FlightControls(args.sim_hz)
+    sim      = SimClock(args.sim_hz)
+    profiler = FrameProfiler(['events', 'update', 'project', 'raster', 'text', 'idle', 'flip'])
+    recorder = replay.Recorder(args.record, replay.STARDUST, seed, args.sim_hz, args.dusts) if args.record else None
+    target   = args.max_fps if args.target_fps is None else args.target_fps
+    quality  = QualityController(target) if target else None
+
+    def simulate(request, frame):
+        """Steps and projects the dusts into frame, on the pipeline's worker thread if it has one"""
+        steps, alpha, controls, actions, dusts, mark = request
+        for action in actions:
+            action(stardust)
+        # Update states, in fixed steps independent of the render rate
+        for i in range(steps):
+            if dusts:
+                # Only ever resized at a step, so that a replay can do the same
+                stardust.resize(dusts)
+            if recorder:
+                recorder.record_stardust(stardust, controls)
+            stardust.move_dusts(controls.alpha, controls.beta, controls.step_speed())
+        mark('update')
+
+        points = project_dusts(stardust, alpha)
+        frame['n'] = n = len(points[0])
+        np.copyto(frame['points'][:, :n], stardust.points)
+        frame['view'] = stardust.travel_view
+        mark('project')
+
+    # Stardust is only touched by simulate(), its key actions are queued for it
+    frames   = [ { 'points': np.zeros((3, args.dusts)), 'n': 0, 'view': None } for i in range(2) ]
+    pipeline = Pipeline(simulate, frames, threaded=args.pipeline)
+    no_mark  = lambda stage: None
+    mark     = no_mark if args.pipeline else profiler.mark # The profiler is not thread safe
+    actions  = []
+    pipeline.submit((sim.advance(), sim.alpha, copy.copy(controls), actions, 0, no_mark))
     
     running = True
     clock = pygame.time.Clock()
-    text = font.render('fps: ?', False, (255, 255, 0))
     pygame.event.clear()
+    timer.mark('setup')
 
     key_mappings = {
         pygame.K_1:      [ stardust, lambda s: s.set_view(View.FRONT) ],
@@ -180,10 +410,12 @@ def main():
         pygame.K_x:      [ controls, lambda c: c.pitch_up() ],
         pygame.K_SPACE:  [ controls, lambda c: c.faster() ],
         pygame.K_SLASH:  [ controls, lambda c: c.slower() ],
+        pygame.K_p:      [ profiler, lambda p: p.toggle() ],
     }
     
     # main loop
     while running:
+        profiler.begin_frame()
 
         # Handle Events
         for event in pygame.event.get():
@@ -194,31 +426,66 @@ def main():
                 if event.key in key_mappings:
                     target_obj = key_mappings[event.key][0]
                     func = key_mappings[event.key][1]
-                    func(target_obj)
-        
-        # Update states
-        stardust.move_dusts(controls.alpha, controls.beta, controls.speed)
+                    if target_obj is stardust:
+                        actions.append(func)
+                    else:
+                        func(target_obj)
+        profiler.mark('events')
+
+        # The next frame is simulated while this one is drawn, when pipelined
+        dusts = quality.count_of(args.dusts) if quality else 0
+        pipeline.submit((sim.advance(), sim.alpha, copy.copy(controls), actions, dusts, mark))
+        actions = []
+        frame  = pipeline.collect()
+        points = frame['points'][:, :frame['n']]
+        profiler.mark('update') # Pipelined, the wait for the worker
         
         #
         # Screen update cycle
         #
-        screen.fill((0, 0, 0))
-        pixels = pygame.surfarray.pixels3d(screen)        
-        screen_points = stardust.dusts + center
-        for p in screen_points:
-            pygame.draw.circle(screen, (255,255,255), (p[0],p[1]), stardust.get_dust_size(p) )
-        del pixels
+        if dirty:
+            dirty.erase()
+        else:
+            screen.fill((0, 0, 0))
+        raster.draw(screen, points)
+        profiler.mark('raster')
 
         # it makes sense to throttle the framerate (which is what the 30 in
         # clock.tick(30) achieves) because it is pointless to have a framerate
         # higher than the screen refresh rate (which is usually 60). To run at
-        # full speed, remove the 30
-        clock.tick(30)
-        text = font.render(f'fps: {clock.get_fps():.1f}, view: {stardust.travel_view.name}, s: {controls.speed}, a: {controls.alpha}, b: {controls.beta}', True, (255, 255, 0))
-        screen.blit(text, (10, 10))
+        # full speed, use --max-fps 0
+        clock.tick(args.max_fps)
+        profiler.mark('idle')
+        # Only the fps changes every frame, the rest is a label re-rendered on a change
+        status = f', view: {frame["view"].name}, s: {controls.speed}, a: {controls.alpha}, b: {controls.beta}'
+        if quality:
+            status += f', {quality.label()}'
+        text_rect = hud.draw(screen, (10, 10), [('fps: ', f'{clock.get_fps():.1f}'), (status, '')])
+        profiler.draw_overlay(screen, hud)
+        profiler.mark('text')
         
-        # pygame.display.update()        
-        pygame.display.flip()
+        if dirty:
+            # The profiler overlay is not tracked, it forces full updates
+            rects = np.vstack((dust_rects(points, Stardust.max_dust_size), [tuple(text_rect)]))
+            dirty.present(rects, full=profiler.show)
+        else:
+            pygame.display.flip()
+        pipeline.release(frame)
+        profiler.mark('flip')
+        if timer:
+            timer.mark('first frame')
+            if args.startup_report:
+                print(timer.report())
+            timer = None
+        profiler.end_frame()
+        if quality:
+            quality.update(profiler.frame_time())
+
+    pipeline.close()
+    if args.profile_csv:
+        profiler.dump_csv(args.profile_csv)
+    if recorder:
+        recorder.close_stardust(stardust, controls)
 
 
 if __name__ == '__main__':
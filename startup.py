@@ -0,0 +1,91 @@
+import time
+STARTED = time.perf_counter() # Imported first by the demos, so that this includes their imports
+
+import os
+import json
+import pygame
+
+#
+# Startup path of the demos, from launch to the first frame:
+#
+#   - Only the display and font subsystems are started. pygame.init() also
+#     starts audio and joystick, which the demos don't use and which can take
+#     hundreds of milliseconds, e.g. waiting on a sound server.
+#   - pygame.font.SysFont() lists every font on the system (fc-list) on each
+#     launch. system_font() caches the resolved font file instead.
+#
+
+CACHE_DIR  = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'stardust')
+FONT_CACHE = os.path.join(CACHE_DIR, 'fonts.json')
+
+def init_pygame():
+    """The pygame subsystems the demos use, instead of pygame.init()"""
+    pygame.display.init()
+    pygame.font.init()
+
+
+def system_font(names, size, bold=False, cache=True):
+    """
+    pygame.font.SysFont(names, size, bold) without the font scan, once the path
+    of the font file is cached. pygame's default font stands in when none of
+    the names is installed, as in SysFont().
+    """
+    key    = f'{names}:{"bold" if bold else "regular"}'
+    cached = {}
+    if cache:
+        try:
+            with open(FONT_CACHE) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    entry = cached.get(key)
+    if not isinstance(entry, dict) or (entry['path'] and not os.path.exists(entry['path'])):
+        path = pygame.font.match_font(names, bold=bold) or ''
+        # match_font() silently falls back to the regular face, SysFont() then fakes the bold
+        entry = cached[key] = {
+            'path'      : path,
+            'fake_bold' : bold and (not path or path == (pygame.font.match_font(names) or '')),
+        }
+        if cache:
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(FONT_CACHE, 'w') as f:
+                    json.dump(cached, f, indent=1)
+            except OSError:
+                pass # An unwritable cache only costs the scan
+
+    font = pygame.font.Font(entry['path'] or None, size)
+    if entry['fake_bold']:
+        font.set_bold(True)
+    return font
+
+
+class StartupTimer():
+
+    def __init__(self, started=STARTED):
+        """
+        Time from launch to the first frame, in phases:
+
+            timer.mark('display')
+            ...
+            timer.mark('first frame')
+            print(timer.report())
+
+        mark(phase) charges the time since the previous mark, or since startup was
+        imported, to phase.
+        """
+        self.last   = started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def total(self):
+        return sum(t for phase, t in self.phases)
+
+    def report(self):
+        phases = ', '.join(f'{phase} {t*1000:.0f}' for phase, t in self.phases)
+        return f'startup: {self.total()*1000:.0f} ms ({phases})'
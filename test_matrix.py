@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import matrix
+from matrix import rot_matrix, rigid_matrix, rigid_inverse, matmul, DTYPE
+
+def poses(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        yield dict(zip(('r', 'p', 'y'), rng.uniform(-180, 180, 3)), **dict(zip(('xo', 'yo', 'zo'), rng.uniform(-20, 20, 3))))
+
+@pytest.fixture
+def backend():
+    """Restores the backend a test switches"""
+    previous = matrix.BACKEND
+    yield matrix.set_backend
+    matrix.set_backend(previous)
+
+def each_backend(set_backend, f):
+    results = []
+    for name in matrix.BACKENDS:
+        set_backend(name)
+        results.append(f())
+    return results
+
+def assert_close(a, b):
+    assert a.dtype == b.dtype == DTYPE
+    assert a.shape == b.shape == (4, 4)
+    np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-5)
+
+def test_rot_matrix_backends_agree(backend):
+    for pose in poses():
+        assert_close(*each_backend(backend, lambda: rot_matrix(**pose)))
+
+def test_rigid_matrix_backends_agree(backend):
+    for pose in poses():
+        m = rot_matrix(**pose)
+        assert_close(*each_backend(backend, lambda: rigid_matrix(m[:3,:3], m[:3,3])))
+        assert_close(rigid_matrix(m[:3,:3], m[:3,3]), m)
+
+def test_rigid_inverse_backends_agree(backend):
+    for pose in poses():
+        m = rot_matrix(**pose)
+        for inverse in each_backend(backend, lambda: rigid_inverse(m[:3,:3], m[:3,3])):
+            np.testing.assert_allclose(matmul(m, inverse), np.identity(4), atol=1e-4)
+        assert_close(*each_backend(backend, lambda: rigid_inverse(m[:3,:3], m[:3,3])))
+
+def test_set_backend_rejects_unknown_names(backend):
+    with pytest.raises(ValueError):
+        backend('fortran')
+    assert matrix.BACKEND in matrix.BACKENDS
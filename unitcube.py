@@ -1,64 +1,132 @@
 import math
 import numpy as np
 from matrix import *
+from culling import UniformGrid
+from mesh import Mesh
+from simclock import REFERENCE_HZ
 
 class UnitCube():
     
-    vertices = np_array([
-        [ -0.5, -0.5, -0.5, 1],
-        [  0.5,  0.5, -0.5, 1],
-        [  0.5, -0.5, -0.5, 1],
-        [ -0.5,  0.5, -0.5, 1],
-
-        [ -0.5, -0.5, 0.5, 1],
-        [  0.5,  0.5, 0.5, 1],
-        [  0.5, -0.5, 0.5, 1],
-        [ -0.5,  0.5, 0.5, 1],
-    ])
-    
-    verticesT = vertices.transpose()
-    
-    edges = [
-        [ 0, 2 ],
-        [ 0, 3 ],
-        [ 2, 1 ],
-        [ 3, 1 ],
+    mesh = Mesh(
+        [
+            [ -0.5, -0.5, -0.5 ],
+            [  0.5,  0.5, -0.5 ],
+            [  0.5, -0.5, -0.5 ],
+            [ -0.5,  0.5, -0.5 ],
 
-        [ 0, 4 ], 
-        [ 1, 5 ],
-        [ 2, 6 ],
-        [ 3, 7 ],
+            [ -0.5, -0.5, 0.5 ],
+            [  0.5,  0.5, 0.5 ],
+            [  0.5, -0.5, 0.5 ],
+            [ -0.5,  0.5, 0.5 ],
+        ],
+        [
+            [ 0, 2 ],
+            [ 0, 3 ],
+            [ 2, 1 ],
+            [ 3, 1 ],
 
-        [ 4, 6 ],
-        [ 4, 7 ],
-        [ 6, 5 ],
-        [ 7, 5 ]
+            [ 0, 4 ], 
+            [ 1, 5 ],
+            [ 2, 6 ],
+            [ 3, 7 ],
 
-    ]
+            [ 4, 6 ],
+            [ 4, 7 ],
+            [ 6, 5 ],
+            [ 7, 5 ]
+        ],
+        # larger z is red, # sides is yellow, smaller z is blue
+        [(0,0,255)]*4 + [(90,90,0)]*4 + [(255,0,0)]*4,
+        'Unit cube')
 
     def __init__(self, x, y, z):
         self.model_matrix = rot_matrix(xo=x, yo=y, zo=z)
         self.rotate = [ np.random.randint(0,5) for i in range(3) ]
+        self.delta  = rot_matrix(r=self.rotate[0],p=self.rotate[1],y=self.rotate[2]) # The spin of one update
 
     def update(self):
-        self.model_matrix = matmul(self.model_matrix, rot_matrix(r=self.rotate[0],p=self.rotate[1],y=self.rotate[2]))
+        # UnitCubes.update() spins all its cubes at once instead
+        self.model_matrix[:] = matmul(self.model_matrix, self.delta)
         return
-    
+
     def draw(self, painter):
         painter.push_matrix(self.model_matrix, "Model(Cube)")
-        pv = painter.project(self.verticesT)
-
-        colors = [(0,0,255),(90,90,0),(255,0,0)]
-        count = 0
-        for edge in self.edges:
-            p1, p2 = edge
-            # larger z is red, # sides is yellow, smaller z is blue
-            color = colors[1]
-            if count<4:
-                color = colors[0] 
-            elif count>=8:
-                color = colors[2]
-            painter.draw_line(pv[p1], pv[p2], color)
-            count+=1
+        self.mesh.draw(painter)
         painter.pop_matrix()
 
+
+class UnitCubes():
+
+    normalize_every = 32 # Updates between re-normalizations of the orientations
+
+    def __init__(self, cubes, mesh=None, hz=REFERENCE_HZ):
+        """
+        Instanced UnitCubes. The model matrices of all the cubes are stacked into
+        one (N,4,4) array, each cube keeping a view of its own matrix, so that the
+        vertices of every instance are projected with a single batched matmul.
+
+        mesh, if given, is drawn for every instance in place of the cube, e.g. a
+        ship from mesh.load_mesh().
+
+        hz is the simulation rate update() is called at, the rotate angles of the
+        cubes being per step at REFERENCE_HZ.
+        """
+        self.cubes = cubes
+        self.mesh  = mesh or UnitCube.mesh
+        self.model_matrices = np.stack([ cube.model_matrix for cube in cubes ]) if cubes else np.zeros((0,4,4), dtype=DTYPE)
+        for i, cube in enumerate(cubes):
+            cube.model_matrix = self.model_matrices[i]
+        self.edge_colors = np.tile(self.mesh.edge_colors, (len(cubes), 1))
+
+        # Orientations as quaternions, spun by one batched matmul per update with
+        # each cube's spin as a quaternion product matrix, see matrix.product_matrices()
+        self.orientations = quaternions_from_rotations(self.model_matrices[:, :3, :3]).astype(DTYPE)
+        spins = euler_quaternions(*(np.multiply([ cube.rotate for cube in cubes ], DEGREES * REFERENCE_HZ / hz).reshape(-1, 3).T))
+        self.spins   = product_matrices(spins).astype(DTYPE)
+        self.next    = np.empty_like(self.orientations)       # Double buffer of update()
+        self.scratch = np.empty((len(cubes), 4, 4), dtype=DTYPE) # rotations_from_quaternions()
+        self.updates = 0
+
+        # The cubes spin in place, so their bounding spheres are static
+        self.index   = UniformGrid(self.model_matrices[:, :3, 3], self.mesh.radius)
+        self.visible = np.arange(len(cubes))
+        self.visible_models = np.empty_like(self.model_matrices) # Gathered for project_instances()
+        self.limit   = None # Most cubes to draw, the nearest to the camera are kept
+
+    def __len__(self):
+        return len(self.cubes)
+
+    def __setstate__(self, state):
+        # Unpickled cubes hold copies, point them back into the stack
+        self.__dict__.update(state)
+        for i, cube in enumerate(self.cubes):
+            cube.model_matrix = self.model_matrices[i]
+
+    def update(self):
+        """Spin every cube by its own rotate angles, model = model⋅Y⋅P⋅R"""
+        q = np.matmul(self.spins, self.orientations[:,:,None], out=self.next[:,:,None])[:,:,0]
+        self.next, self.orientations = self.orientations, q
+        self.updates += 1
+        if self.updates % self.normalize_every == 0:
+            normalize_quaternions(q)
+        rotations_from_quaternions(q, out=self.model_matrices[:, :3, :3], scratch=self.scratch)
+
+    def project(self, painter):
+        """Projects only the cubes inside the view frustum, up to the perspective division"""
+        self.visible = self.index.query(painter.frustum_planes())
+        if self.limit is not None and len(self.visible) > self.limit:
+            d = self.index.centers[self.visible] - painter.camera.translation
+            nearest = np.argpartition(np.sum(d*d, axis=1), self.limit - 1)[:self.limit]
+            self.visible = np.sort(self.visible[nearest])
+        models = np.take(self.model_matrices, self.visible, axis=0, out=self.visible_models[:len(self.visible)])
+        return painter.project_instances(models, self.mesh.verticesT, divide=False)
+
+    def draw(self, painter, pvs=None):
+        if pvs is None:
+            pvs = self.project(painter)
+        edges = self.mesh.edges
+        # All the edges of all the instances as one batch of lines
+        painter.draw_clipped_lines(pvs[:, edges[:,0]].reshape(-1, 4),
+                                   pvs[:, edges[:,1]].reshape(-1, 4),
+                                   self.edge_colors[:len(pvs)*len(edges)])
+